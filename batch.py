@@ -0,0 +1,116 @@
+# builds one knowledge base per episode for every episode found under ./json
+#   $ python batch.py --output-dir ./kb --workers 8
+
+import argparse
+import collections
+import concurrent.futures
+import glob
+import os
+import re
+import sys
+import time
+
+import kb_writer
+import main
+
+# merge order of the source directories, same as main.py
+SOURCE_ORDER = ['place', 'sound_event', 'tracking', 'action', 'emotion', 'triple', 'swrc', 'object']
+SOURCE_KINDS = {'object': 'relation_object'}
+
+EPISODE_PATTERN = re.compile(r'friends_s(\d+)_e(\d+)\.jsonl$')
+
+
+def find_episodes(json_dir, subtitle_dir):
+    # (season, episode) -> [(path, kind), ...] in merge order
+    found = collections.defaultdict(dict)
+    for path in glob.glob(os.path.join(json_dir, '*', 'data', 'friends', 'friends_s*_e*.jsonl')):
+        match = EPISODE_PATTERN.search(os.path.basename(path))
+        if match is None:
+            continue
+        source = os.path.relpath(path, json_dir).split(os.sep)[0]
+        found[(int(match.group(1)), int(match.group(2)))][source] = path
+
+    def source_rank(source):
+        if source in SOURCE_ORDER:
+            return (SOURCE_ORDER.index(source), source)
+        return (len(SOURCE_ORDER), source)
+
+    episodes = {}
+    for key, paths in sorted(found.items()):
+        sources = [(paths[source], SOURCE_KINDS.get(source, 'label')) for source in sorted(paths, key=source_rank)]
+        subtitle = os.path.join(subtitle_dir, 's{:02d}_e{:02d}.jsonl'.format(*key))
+        if os.path.exists(subtitle):
+            sources.append((subtitle, 'subtitle'))
+        episodes[key] = sources
+    return episodes
+
+
+def init_worker():
+    if main.logger is None:
+        main.init_logger()
+
+
+def build_episode(season, episode, sources, output_dir, compression=None, split_classes=False):
+    start = time.time()
+    labels = main.Labels()
+    num_labels = 0
+    for path, kind in sources:
+        batch = main.read_source(path, kind)
+        num_labels += len(batch)
+        labels.add_labels(batch)
+
+    name = 'friends_s{:02d}_e{:02d}'.format(season, episode)
+    # one file per episode, or a directory of per-class files
+    output = os.path.join(output_dir, name)
+    if not split_classes:
+        output += '.jsonl' + kb_writer.COMPRESSIONS.get(compression, '')
+    kb_writer.write_knowledge_base(labels, output, compression, split_classes)
+    return name, num_labels, len(labels.entities), time.time() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json-dir', default='./json')
+    parser.add_argument('--subtitle-dir', default='./subtitle')
+    parser.add_argument('--output-dir', default='./kb')
+    parser.add_argument('--season', type=int, default=None, help='only build episodes of this season')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None)
+    parser.add_argument('--split-classes', action='store_true',
+                        help='write a directory of <class>.jsonl files per episode')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='episodes built in parallel (default: number of cores)')
+    return parser.parse_args()
+
+
+def main_batch():
+    args = parse_args()
+    episodes = find_episodes(args.json_dir, args.subtitle_dir)
+    if args.season is not None:
+        episodes = {key: sources for key, sources in episodes.items() if key[0] == args.season}
+    if not episodes:
+        print('no episodes found under %s' % args.json_dir, file=sys.stderr)
+        return
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start = time.time()
+    total_labels, total_entities = 0, 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        futures = [executor.submit(build_episode, season, episode, sources, args.output_dir,
+                                   args.compression, args.split_classes)
+                   for (season, episode), sources in episodes.items()]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            name, num_labels, num_entities, elapsed = future.result()
+            total_labels += num_labels
+            total_entities += num_entities
+            print('[%d/%d] %s: %d labels, %d entities in %.1f sec' % (
+                done, len(futures), name, num_labels, num_entities, elapsed), file=sys.stderr)
+
+    elapsed = time.time() - start
+    print('%d episodes, %d labels, %d entities in %.1f sec (%.0f labels/sec, %.2f episodes/sec)' % (
+        len(episodes), total_labels, total_entities, elapsed,
+        total_labels / elapsed, len(episodes) / elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main_batch()
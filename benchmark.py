@@ -0,0 +1,153 @@
+# micro benchmarks for the knowledge base builder
+#   $ python benchmark.py merge --season 1 --episode 1
+
+import argparse
+import gc
+import glob
+import time
+import tracemalloc
+
+import jsonio
+import main
+import relation_caption
+
+
+def get_tracking_labels(season, episode, fps):
+    # person boxes of json/tracking as object labels
+    labels = []
+    pattern = './json/tracking/person/S{:02d}_EP{:02d}/*.json'.format(season, episode)
+    for bbox_fpath in sorted(glob.glob(pattern)):
+        frame_number = int(bbox_fpath[-10:-5])
+        bboxes = jsonio.load_json(bbox_fpath)
+        for bbox in bboxes:
+            x1, y1 = bbox['topleft']['x'], bbox['topleft']['y']
+            x2, y2 = bbox['bottomright']['x'], bbox['bottomright']['y']
+            labels.append({
+                'type': 'object',
+                'class': bbox['label'],
+                'label': bbox['label'],
+                'seconds': frame_number / fps,
+                'coordinates': [x1, y1, x2 - x1, y2 - y1]
+            })
+    return labels
+
+
+def load_episode_labels(season, episode):
+    # every jsonl source of an episode under ./json, in main.py's order
+    file = 'friends_s{:02d}_e{:02d}.jsonl'.format(season, episode)
+    labels = main.Labels()
+    for source in ['place', 'sound_event', 'action', 'emotion', 'triple', 'swrc', 'object']:
+        kind = 'relation_object' if source == 'object' else 'label'
+        labels.add_labels(main.read_source('./json/%s/data/friends/%s' % (source, file), kind))
+    subtitle = './subtitle/s{:02d}_e{:02d}.jsonl'.format(season, episode)
+    labels.add_labels(main.read_source(subtitle, 'subtitle'))
+    return labels
+
+
+def bench_merge(args):
+    tracking = get_tracking_labels(args.season, args.episode, args.fps)
+    results = {}
+    for spatial_index in (False, True):
+        start = time.perf_counter()
+        labels = main.Labels(spatial_index=spatial_index)
+        for label in tracking:
+            labels.add_label(dict(label))
+        elapsed = time.perf_counter() - start
+        results[spatial_index] = list(labels.get_entities_iter())
+        print('spatial_index=%-5s %d labels, %d entities, %.3f sec' % (
+            spatial_index, len(tracking), len(results[spatial_index]), elapsed))
+    print('identical graphs:', results[False] == results[True])
+
+
+def bench_batch(args):
+    tracking = get_tracking_labels(args.season, args.episode, args.fps)
+    results = {}
+    for batch in (False, True):
+        start = time.perf_counter()
+        labels = main.Labels()
+        if batch:
+            labels.add_object_labels([dict(label) for label in tracking])
+        else:
+            for label in tracking:
+                labels.add_label(dict(label))
+        elapsed = time.perf_counter() - start
+        results[batch] = list(labels.get_entities_iter())
+        print('batch=%-5s %d labels, %d entities, %.3f sec' % (
+            batch, len(tracking), len(results[batch]), elapsed))
+    print('identical graphs:', results[False] == results[True])
+
+
+def bench_memory(args):
+    # process-wide tables (the relation caption parser) are loaded before tracing,
+    # they would otherwise be counted and survive del labels
+    relation_caption.get_parser()
+    gc.collect()
+    tracemalloc.start()
+    labels = load_episode_labels(args.season, args.episode)
+    gc.collect()
+    dict_size = tracemalloc.get_traced_memory()[0]
+    num_entities = len(labels.entities)
+
+    store = labels.compact()
+    del labels
+    gc.collect()
+    compact_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('%d entities' % num_entities)
+    print('dict entities:    %.1f MB' % (dict_size / 1e6))
+    print('compact entities: %.1f MB (%.1fx smaller)' % (compact_size / 1e6, dict_size / compact_size))
+
+
+def bench_decode(args):
+    # lines/sec of every installed json backend over the episode's jsonl sources
+    fpaths = sorted(glob.glob('./json/*/data/friends/friends_s{:02d}_e{:02d}.jsonl'.format(args.season, args.episode)))
+    lines = []
+    for fpath in fpaths:
+        with open(fpath, 'rb') as fin:
+            lines.extend(line for line in fin.read().splitlines() if line.strip())
+    for backend in jsonio.available_backends():
+        name, loads, errors = jsonio.get_backend(backend)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for line in lines:
+                loads(line)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-8s %d lines in %.3f sec, %.0f lines/sec' % (name, len(lines), best, len(lines) / best))
+
+
+def main_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    merge = subparsers.add_parser('merge', help='coordinate merging on json/tracking boxes')
+    merge.add_argument('--season', type=int, default=1)
+    merge.add_argument('--episode', type=int, default=1)
+    merge.add_argument('--fps', type=float, default=5.0)
+    merge.set_defaults(func=bench_merge)
+
+    batch = subparsers.add_parser('batch', help='scalar add_label against add_object_labels')
+    batch.add_argument('--season', type=int, default=1)
+    batch.add_argument('--episode', type=int, default=1)
+    batch.add_argument('--fps', type=float, default=5.0)
+    batch.set_defaults(func=bench_batch)
+
+    memory = subparsers.add_parser('memory', help='dict entities against the compact store')
+    memory.add_argument('--season', type=int, default=1)
+    memory.add_argument('--episode', type=int, default=1)
+    memory.set_defaults(func=bench_memory)
+
+    decode = subparsers.add_parser('decode', help='json decoding backends')
+    decode.add_argument('--season', type=int, default=1)
+    decode.add_argument('--episode', type=int, default=1)
+    decode.add_argument('--repeat', type=int, default=3)
+    decode.set_defaults(func=bench_decode)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main_args()
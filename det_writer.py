@@ -0,0 +1,150 @@
+# buffered writer for MOT-style detection rows (json/tracking/det/SXX_EPYY/det.txt)
+# rows are collected in memory and written in blocks by a background thread,
+# either every flush_interval seconds or once flush_rows rows are pending
+
+import argparse
+import os
+import threading
+
+import numpy as np
+
+import frame_store
+
+# frame, id, x, y, width, height, [confidence,] -1, -1, -1
+ROW_FORMAT = '%d,%d,%f,%f,%f,%f,%d,%d,%d \n'
+CONF_ROW_FORMAT = '%d,%d,%f,%f,%f,%f,%f,%d,%d,%d \n'
+
+
+class DetectionWriter:
+    def __init__(self, path, conf=False, mode='a', flush_rows=4096, flush_interval=1.0, npy_path=None):
+        self.path = path
+        self.conf = conf
+        self.row_format = CONF_ROW_FORMAT if conf else ROW_FORMAT
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.npy_path = npy_path  # optional float64 array of the rows, saved on close
+        self.blocks = []
+
+        self.fout = open(path, mode)
+        self.rows = []
+        self.lock = threading.Lock()      # guards self.rows
+        self.io_lock = threading.Lock()   # keeps blocks in order
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, frame_number, x, y, width, height, confidence=0.0, id=-1):
+        row = (frame_number, id, x, y, width, height)
+        if self.conf:
+            row += (confidence - 0.5,)
+        with self.lock:
+            self.rows.append(row + (-1, -1, -1))
+            pending = len(self.rows)
+        if pending >= self.flush_rows:
+            self.wakeup.set()
+
+    def add_rows(self, rows):
+        # rows: (n, 10) array-like with the conf column, or (n, 9) without it
+        rows = [tuple(row) for row in np.asarray(rows).tolist()]
+        with self.lock:
+            self.rows.extend(rows)
+            pending = len(self.rows)
+        if pending >= self.flush_rows:
+            self.wakeup.set()
+
+    def run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.io_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return
+            row_format = self.row_format
+            self.fout.write(''.join([row_format % row for row in rows]))
+            self.fout.flush()
+            if self.npy_path is not None:
+                self.blocks.append(np.array(rows, dtype=np.float64))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+        self.fout.close()
+        if self.npy_path is not None:
+            columns = len(self.row_format.split(','))
+            rows = np.concatenate(self.blocks) if self.blocks else np.zeros((0, columns))
+            np.save(self.npy_path, rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_person_rows(store, conf=False, first_frame=None):
+    # det rows of every 'person' box in a packed json/tracking/person store
+    person_label = store.string_ids.get('person', -1)
+    counts = np.diff(np.asarray(store.offsets))
+    frames = np.repeat(np.arange(store.first_frame, store.first_frame + store.num_frames), counts)
+    records = store.records
+    keep = np.asarray(records['label']) == person_label
+    if first_frame is not None:
+        keep &= frames >= first_frame
+    records = records[keep]
+
+    columns = [frames[keep], np.full(len(records), -1),
+               records['x1'], records['y1'], records['x2'] - records['x1'], records['y2'] - records['y1']]
+    if conf:
+        columns.append(records['confidence'].astype(np.float64) - 0.5)
+    columns += [np.full(len(records), -1)] * 3
+    return np.stack([np.asarray(column, dtype=np.float64) for column in columns], axis=1)
+
+
+def export_episode(tracking_dir, output_dir, season, episode, conf=False, npy=False, cache_dir='./cache'):
+    # writes det.txt of the whole episode without the viewer
+    episode_dir = 'S{:02d}_EP{:02d}'.format(season, episode)
+    store = frame_store.load_or_pack(os.path.join(tracking_dir, 'person', episode_dir),
+                                     frame_store.get_packed_path(cache_dir, 'person', season, episode), 'person')
+    save_path = os.path.join(output_dir, episode_dir)
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    save_file = os.path.join(save_path, 'det.txt')
+    npy_path = os.path.join(save_path, 'det.npy') if npy else None
+
+    # the viewer starts at frame 2, keep the same rows
+    rows = get_person_rows(store, conf, first_frame=2)
+    with DetectionWriter(save_file, conf=conf, mode='w', npy_path=npy_path) as writer:
+        writer.add_rows(rows)
+    return save_file, len(rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='export person detections of an episode as det.txt')
+    parser.add_argument('--tracking-dir', default='./json/tracking')
+    parser.add_argument('--output-dir', default='./json/tracking/det')
+    parser.add_argument('--season', type=int, default=1)
+    parser.add_argument('--episode', type=int, default=1)
+    parser.add_argument('--conf', action='store_true', help='write the confidence column')
+    parser.add_argument('--npy', action='store_true', help='also save the rows as det.npy')
+    return parser.parse_args()
+
+
+def main_export():
+    args = parse_args()
+    save_file, num_rows = export_episode(args.tracking_dir, args.output_dir, args.season, args.episode,
+                                         conf=args.conf, npy=args.npy)
+    print('%d rows -> %s' % (num_rows, save_file))
+
+
+if __name__ == '__main__':
+    main_export()
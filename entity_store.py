@@ -0,0 +1,336 @@
+# compact columnar storage for a finished entity graph
+# keeps the get_entities_iter() contract of Labels, but stores entities as
+# typed columns and interned strings instead of one nested dict per entity
+
+import array
+import math
+
+from time_index import TimeIndex
+
+ID_OTHER = 0
+ID_OBJECT = 1
+ID_PROPERTY = 2
+ID_PREFIXES = {'O': ID_OBJECT, 'P': ID_PROPERTY}
+ID_FORMATS = {ID_OBJECT: 'O%d', ID_PROPERTY: 'P%d'}
+
+TIME_KEYS = ('seconds', 'frames')
+
+# array columns and their typecodes
+COLUMNS = [
+    ('entity_layout', 'i'), ('value_layout', 'i'), ('entity_type', 'i'), ('entity_class', 'i'),
+    ('id_kind', 'b'), ('id_num', 'q'), ('source', 'i'), ('target', 'i'), ('time', 'd'),
+    ('label', 'i'), ('box', 'i'), ('boxes', 'd'), ('extra', 'i'),
+]
+
+
+def split_entity_id(entity_id):
+    # 'O12' -> (ID_OBJECT, 12)
+    if isinstance(entity_id, str) and entity_id[:1] in ID_PREFIXES and entity_id[1:].isdigit():
+        num = int(entity_id[1:])
+        if ID_FORMATS[ID_PREFIXES[entity_id[0]]] % num == entity_id:
+            return ID_PREFIXES[entity_id[0]], num
+    return ID_OTHER, 0
+
+
+class CompactEntities:
+    def __init__(self):
+        self.strings = []       # interned strings
+        self.string_ids = {}
+        self.layouts = []       # (key, code) layouts of entity and value dicts
+        self.layout_ids = {}
+
+        # one row per entity
+        self.entity_layout = array.array('i')
+        self.value_layout = array.array('i')   # -1 without value
+        self.entity_type = array.array('i')    # string id
+        self.entity_class = array.array('i')   # string id
+        self.id_kind = array.array('b')
+        self.id_num = array.array('q')
+        self.source = array.array('i')         # row, -1 without source
+        self.target = array.array('i')         # row, -1 without target
+        self.time = array.array('d')           # value seconds/frames, nan without
+        self.label = array.array('i')          # string id, -1 without label
+        self.box = array.array('i')            # index into boxes, -1 without box
+        self.boxes = array.array('d')          # [x, y, width, height] per box
+        self.extra = array.array('i')          # index into extras, -1 without extras
+        self.extras = []                       # tuple of the remaining field values
+
+        # rarely used fields: ids other than O#/P# and references to missing entities
+        self.other_ids = {}
+        self.dangling = {}
+
+        # entity id -> row
+        self.id_rows = {ID_OBJECT: array.array('i'), ID_PROPERTY: array.array('i')}
+        self.other_rows = {}
+        self.time_index = None
+
+    @classmethod
+    def from_entities(cls, entities):
+        store = cls()
+        refs = []
+        for entity in entities:
+            row = store.add_entity(entity)
+            if 'source' in entity or 'target' in entity:
+                refs.append((row, entity.get('source'), entity.get('target')))
+        # properties may point at entities stored after them
+        for row, source, target in refs:
+            for key, ref, column in (('source', source, store.source), ('target', target, store.target)):
+                ref_row = store.get_row(ref)
+                if ref_row == -1:
+                    store.dangling[(row, key)] = ref
+                column[row] = ref_row
+        return store
+
+    def intern(self, string):
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    def get_layout_id(self, layout):
+        layout_id = self.layout_ids.get(layout)
+        if layout_id is None:
+            layout_id = len(self.layouts)
+            self.layouts.append(layout)
+            self.layout_ids[layout] = layout_id
+        return layout_id
+
+    def get_row(self, entity_id):
+        kind, num = split_entity_id(entity_id)
+        if kind == ID_OTHER:
+            try:
+                return self.other_rows.get(entity_id, -1)
+            except TypeError:
+                return -1
+        rows = self.id_rows[kind]
+        return rows[num] if num < len(rows) else -1
+
+    def set_row(self, entity_id, row):
+        kind, num = split_entity_id(entity_id)
+        if kind == ID_OTHER:
+            self.other_rows[entity_id] = row
+            return
+        rows = self.id_rows[kind]
+        if num >= len(rows):
+            rows.extend([-1] * (num + 1 - len(rows)))
+        rows[num] = row
+
+    def encode_extra(self, value, extras):
+        # strings share the objects of the string table
+        if isinstance(value, str):
+            extras.append(self.strings[self.intern(value)])
+            return 'x'
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            extras.append(tuple(self.strings[self.intern(v)] for v in value))
+            return 'xl'
+        extras.append(value)
+        return 'x'
+
+    def add_entity(self, entity):
+        row = len(self.entity_layout)
+        entity_type, entity_class = -1, -1
+        id_kind, id_num = ID_OTHER, 0
+        value_layout, time, label, box = -1, math.nan, -1, -1
+        layout = []
+        extras = []
+        for key, value in entity.items():
+            if key == 'entity_type' and isinstance(value, str):
+                entity_type = self.intern(value)
+                layout.append((key, 's'))
+            elif key == 'class' and isinstance(value, str):
+                entity_class = self.intern(value)
+                layout.append((key, 's'))
+            elif key == 'id':
+                id_kind, id_num = split_entity_id(value)
+                if id_kind == ID_OTHER:
+                    self.other_ids[row] = value
+                self.set_row(value, row)
+                layout.append((key, 'i'))
+            elif key in ('source', 'target'):
+                # resolved to a row once every entity is stored
+                layout.append((key, 'r'))
+            elif key == 'value' and isinstance(value, dict):
+                value_layout, time, label, box = self.add_value(value, extras)
+                layout.append((key, 'v'))
+            else:
+                layout.append((key, self.encode_extra(value, extras)))
+
+        self.entity_layout.append(self.get_layout_id(tuple(layout)))
+        self.value_layout.append(value_layout)
+        self.entity_type.append(entity_type)
+        self.entity_class.append(entity_class)
+        self.id_kind.append(id_kind)
+        self.id_num.append(id_num)
+        self.source.append(-1)
+        self.target.append(-1)
+        self.time.append(time)
+        self.label.append(label)
+        self.box.append(box)
+        if extras:
+            self.extra.append(len(self.extras))
+            self.extras.append(tuple(extras))
+        else:
+            self.extra.append(-1)
+        return row
+
+    def add_value(self, value, extras):
+        time, label, box = math.nan, -1, -1
+        layout = []
+        for key, v in value.items():
+            if key in TIME_KEYS and math.isnan(time) and type(v) in (int, float) and not math.isnan(v):
+                time = v
+                layout.append((key, 'ti' if type(v) is int else 'tf'))
+            elif key == 'label' and isinstance(v, str):
+                label = self.intern(v)
+                layout.append((key, 'l'))
+            elif key == 'coordinates' and box == -1 and isinstance(v, list) and len(v) == 4 \
+                    and all(type(c) in (int, float) for c in v):
+                box = len(self.boxes) // 4
+                self.boxes.extend(v)
+                layout.append((key, 'b' + ''.join('i' if type(c) is int else 'f' for c in v)))
+            else:
+                layout.append((key, self.encode_extra(v, extras)))
+        return self.get_layout_id(tuple(layout)), time, label, box
+
+    def get_entity_id(self, row):
+        kind = self.id_kind[row]
+        if kind == ID_OTHER:
+            return self.other_ids[row]
+        return ID_FORMATS[kind] % self.id_num[row]
+
+    def get_entity(self, row):
+        extras = iter(self.extras[self.extra[row]] if self.extra[row] != -1 else ())
+        entity = {}
+        for key, code in self.layouts[self.entity_layout[row]]:
+            if code == 's':
+                column = self.entity_type if key == 'entity_type' else self.entity_class
+                entity[key] = self.strings[column[row]]
+            elif code == 'i':
+                entity[key] = self.get_entity_id(row)
+            elif code == 'r':
+                ref = self.source[row] if key == 'source' else self.target[row]
+                entity[key] = self.get_entity_id(ref) if ref != -1 else self.dangling[(row, key)]
+            elif code == 'v':
+                entity[key] = self.get_value(row, extras)
+            elif code == 'xl':
+                entity[key] = list(next(extras))
+            else:
+                entity[key] = next(extras)
+        return entity
+
+    def get_value(self, row, extras):
+        value = {}
+        for key, code in self.layouts[self.value_layout[row]]:
+            if code == 'tf':
+                value[key] = float(self.time[row])
+            elif code == 'ti':
+                value[key] = int(self.time[row])
+            elif code == 'l':
+                value[key] = self.strings[self.label[row]]
+            elif code[0] == 'b':
+                start = self.box[row] * 4
+                coords = self.boxes[start:start + 4]
+                value[key] = [int(c) if t == 'i' else float(c) for c, t in zip(coords, code[1:])]
+            elif code == 'xl':
+                value[key] = list(next(extras))
+            else:
+                value[key] = next(extras)
+        return value
+
+    def get_entities_iter(self):
+        for row in range(len(self)):
+            yield self.get_entity(row)
+
+    def build_time_index(self, key='seconds'):
+        times, rows = [], []
+        for row in range(len(self)):
+            if self.value_layout[row] == -1:
+                continue
+            for k, code in self.layouts[self.value_layout[row]]:
+                if k != key:
+                    continue
+                if code[0] == 't':
+                    times.append(self.time[row])
+                else:
+                    times.append(self.get_entity(row)['value'][key])
+                rows.append(row)
+        self.time_index = TimeIndex.from_times(times, rows, key)
+        return self.time_index
+
+    def entities_between(self, t0, t1, include_start=True, include_end=False):
+        if self.time_index is None:
+            self.build_time_index()
+        rows = self.time_index.between(t0, t1, include_start, include_end)
+        return [self.get_entity(row) for row in rows]
+
+    def entities_at_frame(self, frame):
+        return self.entities_between(frame, frame + 1)
+
+    def get_columns(self):
+        # typed arrays plus the python-side tables as json-able values, see from_columns
+        columns = {name: getattr(self, name) for name, typecode in COLUMNS}
+        columns['object_rows'] = self.id_rows[ID_OBJECT]
+        columns['property_rows'] = self.id_rows[ID_PROPERTY]
+        if self.time_index is not None:
+            columns['index_times'] = array.array('d', self.time_index.times)
+            columns['index_seqs'] = array.array('q', self.time_index.seqs)
+            columns['index_rows'] = array.array('q', self.time_index.items)
+        tables = {
+            'strings': self.strings,
+            'layouts': self.layouts,
+            'extras': self.extras,
+            'other_ids': list(self.other_ids.items()),
+            'other_rows': [[row, entity_id] for entity_id, row in self.other_rows.items()],
+            'dangling': [[row, key, ref] for (row, key), ref in self.dangling.items()],
+            'time_key': self.time_index.key if self.time_index is not None else None,
+        }
+        return columns, tables
+
+    @classmethod
+    def from_columns(cls, columns, tables, copy=True):
+        # columns are buffers (array.array, numpy arrays, ...) of the typecodes in COLUMNS.
+        # without copy the store reads the given buffers, e.g. read-only numpy memmaps
+        def get_column(name, typecode):
+            return array.array(typecode, bytes(columns[name])) if copy else columns[name]
+
+        store = cls()
+        for name, typecode in COLUMNS:
+            setattr(store, name, get_column(name, typecode))
+        store.id_rows = {
+            ID_OBJECT: get_column('object_rows', 'i'),
+            ID_PROPERTY: get_column('property_rows', 'i'),
+        }
+        store.strings = list(tables['strings'])
+        store.string_ids = {string: i for i, string in enumerate(store.strings)}
+        store.layouts = [tuple(tuple(field) for field in layout) for layout in tables['layouts']]
+        store.layout_ids = {layout: i for i, layout in enumerate(store.layouts)}
+        store.extras = [tuple(extras) for extras in tables['extras']]
+        store.other_ids = {row: entity_id for row, entity_id in tables['other_ids']}
+        store.other_rows = {entity_id: row for row, entity_id in tables['other_rows']}
+        store.dangling = {(row, key): ref for row, key, ref in tables['dangling']}
+        if tables['time_key'] is not None:
+            index = TimeIndex(tables['time_key'])
+            if copy:
+                index.times = array.array('d', bytes(columns['index_times'])).tolist()
+                index.seqs = array.array('q', bytes(columns['index_seqs'])).tolist()
+                index.items = array.array('q', bytes(columns['index_rows'])).tolist()
+            else:
+                index.times = columns['index_times']
+                index.seqs = columns['index_seqs']
+                index.items = columns['index_rows']
+            store.time_index = index
+        return store
+
+    def __len__(self):
+        return len(self.entity_layout)
+
+    def __contains__(self, entity_id):
+        return self.get_row(entity_id) != -1
+
+    def __getitem__(self, entity_id):
+        row = self.get_row(entity_id)
+        if row == -1:
+            raise KeyError(entity_id)
+        return self.get_entity(row)
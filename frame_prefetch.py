@@ -0,0 +1,62 @@
+# decodes the frames ahead of the playhead on a thread pool
+# cv2.imread releases the GIL, so JPEG decoding runs off the Kivy main thread
+
+import concurrent.futures
+
+import cv2
+
+
+class FramePrefetcher:
+    def __init__(self, get_path, ahead=32, workers=4, first_frame=1, last_frame=None):
+        self.get_path = get_path  # frame number -> image path
+        self.ahead = ahead
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # frame number -> future, at most `ahead` frames from the playhead. not in frame
+        # order after a backward seek, so frames are evicted by range
+        self.pending = {}
+        # frames whose file could not be read, not read again
+        self.missing = set()
+
+    def read(self, frame_number):
+        return cv2.imread(self.get_path(frame_number))
+
+    def schedule(self, frame_number):
+        end = frame_number + self.ahead
+        if self.last_frame is not None:
+            end = min(end, self.last_frame + 1)
+        for f in range(max(frame_number, self.first_frame), end):
+            if f not in self.pending and f not in self.missing:
+                self.pending[f] = self.executor.submit(self.read, f)
+
+    def seek(self, frame_number):
+        # the playhead jumped, drop the frames decoded for the old position
+        for f in list(self.pending):
+            if f < frame_number or f >= frame_number + self.ahead:
+                self.pending.pop(f).cancel()
+        self.schedule(frame_number)
+
+    def get(self, frame_number):
+        # the decoded frame if it is ready, None while it is still decoding or missing
+        if frame_number in self.missing:
+            return None
+        future = self.pending.get(frame_number)
+        if future is None:
+            self.seek(frame_number)
+            return None
+        if not future.done():
+            return None
+        frame = future.result()
+        if frame is None:
+            self.missing.add(frame_number)
+        for f in [f for f in self.pending if f <= frame_number]:
+            del self.pending[f]
+        self.schedule(frame_number + 1)
+        return frame
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
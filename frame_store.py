@@ -0,0 +1,195 @@
+# packed per-frame box files
+# pack() turns an episode's per-frame json directory (00001.json, 00002.json, ...)
+# into one file: a json header, an offset table and the packed box records.
+# FrameStore memory-maps that file, so reading a frame is a slice instead of
+# opening and parsing one json file per frame
+
+import argparse
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+import jsonio
+import label_cache
+
+MAGIC = b'VGFRAME1'
+ALIGN = 64
+
+# json/tracking/person: detector boxes
+PERSON_DTYPE = np.dtype([
+    ('x1', '<i4'), ('y1', '<i4'), ('x2', '<i4'), ('y2', '<i4'),
+    ('confidence', '<f4'), ('label', '<i4'),
+])
+
+# json/tracking/relation_obj: [x, y, width, height] boxes of the caption subject and object
+RELATION_DTYPE = np.dtype([
+    ('source', '<f8', (4,)), ('target', '<f8', (4,)), ('seconds', '<f8'),
+    ('caption', '<i4'), ('subject', '<i4'), ('predicate', '<i4'), ('object', '<i4'),
+])
+
+
+def get_person_record(box, intern):
+    return (box['topleft']['x'], box['topleft']['y'], box['bottomright']['x'], box['bottomright']['y'],
+            box['confidence'], intern(box['label']))
+
+
+def get_relation_record(box, intern):
+    return (box['source']['coordinates'], box['target']['coordinates'], box['seconds'],
+            intern(box['caption']), intern(box['subject']), intern(box['predicate']), intern(box['object']))
+
+
+KINDS = {
+    'person': (PERSON_DTYPE, get_person_record),
+    'relation_obj': (RELATION_DTYPE, get_relation_record),
+}
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def get_frame_files(json_dir):
+    # frame number -> path
+    files = {}
+    for path in glob.glob(os.path.join(json_dir, '*.json')):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name.isdigit():
+            files[int(name)] = path
+    return files
+
+
+def get_files_key(files):
+    # key of the frame files' paths, mtimes and sizes; editing a file in place does not
+    # change the directory mtime
+    return label_cache.get_cache_key([files[frame] for frame in sorted(files)], 'frames')
+
+
+def pack(json_dir, packed_path, kind):
+    dtype, get_record = KINDS[kind]
+    files = get_frame_files(json_dir)
+    first_frame = min(files) if files else 0
+    num_frames = max(files) - first_frame + 1 if files else 0
+
+    strings = []
+    string_ids = {}
+
+    def intern(string):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    # frames without a file are empty
+    records = []
+    offsets = np.zeros(num_frames + 1, dtype='<i8')
+    for i in range(num_frames):
+        frame = first_frame + i
+        if frame in files:
+            records.extend(get_record(box, intern) for box in jsonio.load_json(files[frame]))
+        offsets[i + 1] = len(records)
+    records = np.array(records, dtype=dtype)
+
+    header = json.dumps({
+        'kind': kind,
+        'dtype': dtype.descr,
+        'first_frame': first_frame,
+        'num_frames': num_frames,
+        'num_records': len(records),
+        'strings': strings,
+        'key': get_files_key(files),
+    }).encode('utf-8')
+    data_start = align(len(MAGIC) + 8 + len(header))
+    records_start = align(data_start + offsets.nbytes)
+
+    packed_dir = os.path.dirname(packed_path)
+    if packed_dir and not os.path.exists(packed_dir):
+        os.makedirs(packed_dir)
+    tmp_path = packed_path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        fout.write(MAGIC)
+        fout.write(struct.pack('<Q', len(header)))
+        fout.write(header)
+        fout.write(b'\0' * (data_start - fout.tell()))
+        fout.write(offsets.tobytes())
+        fout.write(b'\0' * (records_start - fout.tell()))
+        fout.write(records.tobytes())
+    os.replace(tmp_path, packed_path)
+    return len(records)
+
+
+class FrameStore:
+    def __init__(self, packed_path):
+        with open(packed_path, 'rb') as fin:
+            if fin.read(len(MAGIC)) != MAGIC:
+                raise ValueError('not a packed frame file: %s' % packed_path)
+            header_len, = struct.unpack('<Q', fin.read(8))
+            header = json.loads(fin.read(header_len).decode('utf-8'))
+
+        self.kind = header['kind']
+        self.first_frame = header['first_frame']
+        self.num_frames = header['num_frames']
+        self.strings = header['strings']
+        self.key = header.get('key')
+        self.string_ids = {string: i for i, string in enumerate(self.strings)}
+        self.dtype = np.dtype([tuple(field[:2]) + tuple(tuple(f) for f in field[2:]) for field in header['dtype']])
+
+        data_start = align(len(MAGIC) + 8 + header_len)
+        records_start = align(data_start + (self.num_frames + 1) * 8)
+        self.offsets = np.memmap(packed_path, dtype='<i8', mode='r', offset=data_start, shape=(self.num_frames + 1,))
+        if header['num_records']:
+            self.records = np.memmap(packed_path, dtype=self.dtype, mode='r', offset=records_start,
+                                     shape=(header['num_records'],))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return self.num_frames
+
+    def frame(self, frame_number):
+        # structured array of the frame's boxes, a view into the mapped file
+        i = frame_number - self.first_frame
+        if i < 0 or i >= self.num_frames:
+            return self.records[:0]
+        return self.records[self.offsets[i]:self.offsets[i + 1]]
+
+
+def load_or_pack(json_dir, packed_path, kind):
+    # repacks when a frame file was added, removed or changed after the packed file was written
+    if os.path.exists(packed_path):
+        store = FrameStore(packed_path)
+        if store.key == get_files_key(get_frame_files(json_dir)):
+            return store
+    pack(json_dir, packed_path, kind)
+    return FrameStore(packed_path)
+
+
+def get_packed_path(output_dir, kind, season, episode):
+    return os.path.join(output_dir, '{}_S{:02d}_EP{:02d}.frames'.format(kind, season, episode))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='pack per-frame tracking json into indexed files')
+    parser.add_argument('--tracking-dir', default='./json/tracking')
+    parser.add_argument('--output-dir', default='./cache')
+    parser.add_argument('--season', type=int, default=1)
+    parser.add_argument('--episode', type=int, default=1)
+    return parser.parse_args()
+
+
+def main_pack():
+    args = parse_args()
+    for kind in KINDS:
+        json_dir = os.path.join(args.tracking_dir, kind, 'S{:02d}_EP{:02d}'.format(args.season, args.episode))
+        if not os.path.isdir(json_dir):
+            print('skipping %s, no such directory' % json_dir)
+            continue
+        packed_path = get_packed_path(args.output_dir, kind, args.season, args.episode)
+        num_records = pack(json_dir, packed_path, kind)
+        print('%s: %d boxes -> %s' % (json_dir, num_records, packed_path))
+
+
+if __name__ == '__main__':
+    main_pack()
@@ -0,0 +1,105 @@
+# pluggable JSON decoding for the label readers and encoding for the knowledge base writers
+# uses orjson or msgspec when installed and falls back to the standard library,
+# VIZ_GRAPH_JSON=orjson|msgspec|json forces a backend
+
+import json
+import os
+
+BACKEND_ORDER = ['orjson', 'msgspec', 'json']
+
+
+def get_orjson():
+    import orjson
+    return orjson.loads, (orjson.JSONDecodeError,)
+
+
+def get_msgspec():
+    import msgspec
+    return msgspec.json.Decoder().decode, (msgspec.DecodeError,)
+
+
+def get_stdlib():
+    return json.loads, (json.JSONDecodeError, UnicodeDecodeError)
+
+
+def get_orjson_encoder():
+    import orjson
+    return orjson.dumps
+
+
+def get_msgspec_encoder():
+    import msgspec
+    return msgspec.json.Encoder().encode
+
+
+def get_stdlib_encoder():
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return dumps
+
+
+BACKENDS = {
+    'orjson': get_orjson,
+    'msgspec': get_msgspec,
+    'json': get_stdlib,
+}
+
+# dumps(obj) -> compact UTF-8 bytes
+ENCODERS = {
+    'orjson': get_orjson_encoder,
+    'msgspec': get_msgspec_encoder,
+    'json': get_stdlib_encoder,
+}
+
+
+def available_backends():
+    names = []
+    for name in BACKEND_ORDER:
+        try:
+            BACKENDS[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_backend(name=None):
+    # (name, loads, decode errors) of the requested or the fastest installed backend
+    if name is not None:
+        loads, errors = BACKENDS[name]()
+        return name, loads, errors
+    for name in BACKEND_ORDER:
+        try:
+            loads, errors = BACKENDS[name]()
+        except ImportError:
+            continue
+        return name, loads, errors
+
+
+def get_encoder(name=None):
+    # (name, dumps) of the requested or the fastest installed encoder
+    if name is not None:
+        return name, ENCODERS[name]()
+    for name in BACKEND_ORDER:
+        try:
+            return name, ENCODERS[name]()
+        except ImportError:
+            continue
+
+
+backend, loads, DecodeError = get_backend(os.environ.get('VIZ_GRAPH_JSON') or None)
+encoder, dumps = get_encoder(os.environ.get('VIZ_GRAPH_JSON') or None)
+
+
+def iter_jsonl(path, loads=loads):
+    # one decoded object per non-empty line
+    with open(path, 'rb') as fin:
+        for line in fin:
+            line = line.strip()
+            if line:
+                yield loads(line)
+
+
+def load_json(path, loads=loads):
+    with open(path, 'rb') as fin:
+        return loads(fin.read())
@@ -0,0 +1,184 @@
+# columnar export of knowledge bases for dataframe and query engines
+#   $ python kb_parquet.py kb/friends_s01_e01.jsonl.gz --output-dir kb/friends_s01_e01
+# writes objects.parquet and properties.parquet (or .arrow files with --format ipc):
+# nested value fields become flat columns, repeated strings are dictionary encoded and
+# rows are sorted by time, so the row group statistics let readers skip row groups for
+# time-window and class filters. needs pyarrow
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import kb_writer
+
+ROW_GROUP_SIZE = 16384
+NO_BOX = (None, None, None, None)
+
+# columns of value fields, the remaining fields are kept as JSON in 'extra'
+OBJECT_VALUE_KEYS = ('label', 'seconds', 'coordinates')
+PROPERTY_VALUE_KEYS = ('label', 'seconds', 'relation_kb', 'relation_obj', 'relation', 'person',
+                       'source', 'target', 'source_coordinates', 'target_coordinates')
+
+STRING = pa.string()
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+FLOAT = pa.float64()
+INPUT_IDS = pa.list_(DICTIONARY)
+
+OBJECT_SCHEMA = pa.schema([
+    ('id', STRING), ('entity_type', DICTIONARY), ('class', DICTIONARY), ('label', DICTIONARY),
+    ('seconds', FLOAT), ('x', FLOAT), ('y', FLOAT), ('width', FLOAT), ('height', FLOAT),
+    ('input_ids', INPUT_IDS), ('extra', STRING),
+])
+PROPERTY_SCHEMA = pa.schema([
+    ('id', STRING), ('class', DICTIONARY), ('source', STRING), ('target', STRING),
+    ('seconds', FLOAT), ('label', DICTIONARY), ('relation', DICTIONARY), ('relation_id', STRING),
+    ('person', DICTIONARY), ('source_input_ids', INPUT_IDS), ('target_input_ids', INPUT_IDS),
+    ('source_x', FLOAT), ('source_y', FLOAT), ('source_width', FLOAT), ('source_height', FLOAT),
+    ('target_x', FLOAT), ('target_y', FLOAT), ('target_width', FLOAT), ('target_height', FLOAT),
+    ('extra', STRING),
+])
+
+
+def get_box(coordinates):
+    # [x, y, width, height] as in the input format
+    if isinstance(coordinates, (list, tuple)) and len(coordinates) >= 4:
+        return tuple(float(c) for c in coordinates[:4])
+    return NO_BOX
+
+
+def get_extra(value, keys):
+    extra = {key: v for key, v in value.items() if key not in keys}
+    return json.dumps(extra) if extra else None
+
+
+class TableBuilder:
+    def __init__(self, schema):
+        self.schema = schema
+        self.columns = {name: [] for name in schema.names}
+
+    def append(self, row):
+        for name, column in self.columns.items():
+            column.append(row.get(name))
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def build(self):
+        # rows sorted by time, untimed rows last
+        seconds = self.columns['seconds']
+        order = sorted(range(len(seconds)), key=lambda i: (seconds[i] is None or math.isnan(seconds[i]),
+                                                            seconds[i] or 0.0))
+        arrays = []
+        for field in self.schema:
+            values = [self.columns[field.name][i] for i in order]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, type=STRING).dictionary_encode())
+            elif field.type == INPUT_IDS:
+                arrays.append(pa.array(values, type=pa.list_(STRING)).cast(INPUT_IDS))
+            else:
+                arrays.append(pa.array(values, type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+
+def get_object_row(entity):
+    value = entity.get('value', {})
+    x, y, width, height = get_box(value.get('coordinates'))
+    return {
+        'id': entity['id'], 'entity_type': entity.get('entity_type'), 'class': entity.get('class'),
+        'label': value.get('label'), 'seconds': value.get('seconds'),
+        'x': x, 'y': y, 'width': width, 'height': height,
+        'input_ids': entity.get('input_ids'), 'extra': get_extra(value, OBJECT_VALUE_KEYS),
+    }
+
+
+def get_property_row(entity):
+    value = entity.get('value', {})
+    row = {
+        'id': entity['id'], 'class': entity.get('class'),
+        'source': entity.get('source'), 'target': entity.get('target'),
+        'seconds': value.get('seconds'), 'label': value.get('label'),
+        'relation': value.get('relation_kb', value.get('relation_obj')), 'relation_id': value.get('relation'),
+        'person': value.get('person'),
+        'source_input_ids': value.get('source'), 'target_input_ids': value.get('target'),
+        'extra': get_extra(value, PROPERTY_VALUE_KEYS),
+    }
+    for end in ('source', 'target'):
+        box = get_box(value.get(end + '_coordinates'))
+        for key, v in zip(('_x', '_y', '_width', '_height'), box):
+            row[end + key] = v
+    return row
+
+
+def build_tables(entities):
+    # (objects, properties) tables of formatted entities
+    objects = TableBuilder(OBJECT_SCHEMA)
+    properties = TableBuilder(PROPERTY_SCHEMA)
+    for entity in entities:
+        if entity.get('entity_type') == 'property':
+            properties.append(get_property_row(entity))
+        else:
+            objects.append(get_object_row(entity))
+    return objects.build(), properties.build()
+
+
+def export_entities(entities, output_dir, format='parquet', compression='zstd', row_group_size=ROW_GROUP_SIZE):
+    # writes objects and properties tables into output_dir, returns their paths
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if compression == 'none':
+        compression = None if format == 'parquet' else 'uncompressed'
+    paths = []
+    for name, table in zip(('objects', 'properties'), build_tables(entities)):
+        if format == 'parquet':
+            path = os.path.join(output_dir, name + '.parquet')
+            pq.write_table(table, path, row_group_size=row_group_size, compression=compression,
+                           use_dictionary=True, write_statistics=True)
+        else:
+            path = os.path.join(output_dir, name + '.arrow')
+            feather.write_feather(table, path, compression=compression, chunksize=row_group_size)
+        paths.append(path)
+    return paths
+
+
+def export_labels(labels, output_dir, format='parquet', compression='zstd'):
+    # every entity of a main.Labels graph
+    entities = (labels.format_entity(entity) for entity in labels.get_entities_iter())
+    return export_entities(entities, output_dir, format, compression)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='export JSON lines knowledge bases as Parquet or Arrow tables')
+    parser.add_argument('inputs', nargs='+', help='knowledge base files written by main.py or batch.py')
+    parser.add_argument('--output-dir', default=None,
+                        help='directory of the tables (default: the input path without .jsonl[.gz|.zst])')
+    parser.add_argument('--format', choices=['parquet', 'ipc'], default='parquet')
+    parser.add_argument('--compression', default='zstd', help='column compression, e.g. zstd, snappy, none')
+    args = parser.parse_args()
+    if args.output_dir is not None and len(args.inputs) > 1:
+        parser.error('--output-dir takes a single input')
+    return args
+
+
+def main_export():
+    args = parse_args()
+    for path in args.inputs:
+        output_dir = args.output_dir
+        if output_dir is None:
+            output_dir = path
+            for extension in ['.gz', '.zst', '.jsonl']:
+                if output_dir.endswith(extension):
+                    output_dir = output_dir[:-len(extension)]
+            if output_dir == path:
+                output_dir = path + '.tables'
+        paths = export_entities(kb_writer.read_knowledge_base(path), output_dir, args.format, args.compression)
+        print('%s -> %s' % (path, ', '.join(paths)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main_export()
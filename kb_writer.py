@@ -0,0 +1,161 @@
+# JSON lines output of knowledge bases
+# entities are encoded with the fastest installed encoder (jsonio.dumps) and written in
+# blocks of about block_size bytes. outputs ending in .gz or .zst are compressed, and
+# with split_classes every entity class is written to its own file in a directory
+
+import gzip
+import io
+import os
+import re
+import sys
+
+import jsonio
+
+BLOCK_SIZE = 1 << 20
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def get_compression(path):
+    for compression, extension in COMPRESSIONS.items():
+        if path.endswith(extension):
+            return compression
+    return None
+
+
+def open_output(path, compression=None):
+    # (binary stream to write to, files to close after it) for a path, '-' is stdout
+    if path == '-':
+        raw, closes = sys.stdout.buffer, []
+    else:
+        raw = open(path, 'wb')
+        closes = [raw]
+    if compression == 'gzip':
+        stream = gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=6)
+    elif compression == 'zstd':
+        # optional dependency, only needed for .zst outputs
+        import zstandard
+        stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    elif compression is None:
+        return raw, closes
+    else:
+        raise ValueError('unknown compression %s' % compression)
+    return stream, [stream] + closes
+
+
+def open_input(path):
+    compression = get_compression(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+class Output:
+    def __init__(self, path, compression=None, block_size=BLOCK_SIZE):
+        self.stream, self.closes = open_output(path, compression)
+        self.block_size = block_size
+        self.lines = []
+        self.pending = 0
+
+    def write(self, line):
+        self.lines.append(line)
+        self.pending += len(line)
+        if self.pending >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.stream.write(b''.join(self.lines))
+            self.lines = []
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        for f in self.closes:
+            f.close()
+        if not self.closes:
+            self.stream.flush()
+
+
+class KnowledgeBaseWriter:
+    def __init__(self, path, compression=None, split_classes=False, block_size=BLOCK_SIZE):
+        # path is a file ('-' for stdout), or a directory of <class>.jsonl files with split_classes
+        self.path = path
+        self.compression = get_compression(path) if compression is None else compression
+        self.split_classes = split_classes
+        self.block_size = block_size
+        self.outputs = {}  # class (None without split_classes) -> Output
+        self.num_entities = 0
+        if split_classes and not os.path.exists(path):
+            os.makedirs(path)
+        if not split_classes:
+            self.get_output(None)
+
+    def get_output(self, entity_class):
+        key = entity_class if self.split_classes else None
+        output = self.outputs.get(key)
+        if output is None:
+            path = self.path
+            if self.split_classes:
+                name = re.sub(r'[^\w.-]', '_', str(entity_class))
+                path = os.path.join(self.path, name + '.jsonl' + COMPRESSIONS.get(self.compression, ''))
+            output = self.outputs[key] = Output(path, self.compression, self.block_size)
+        return output
+
+    def write(self, entity):
+        # one formatted entity
+        self.get_output(entity.get('class')).write(jsonio.dumps(entity) + b'\n')
+        self.num_entities += 1
+
+    def write_entities(self, entities):
+        dumps = jsonio.dumps
+        if self.split_classes:
+            for entity in entities:
+                self.get_output(entity.get('class')).write(dumps(entity) + b'\n')
+                self.num_entities += 1
+            return
+        output = self.get_output(None)
+        for entity in entities:
+            output.write(dumps(entity) + b'\n')
+            self.num_entities += 1
+
+    def flush(self):
+        # everything written so far, down to the file or pipe
+        for output in self.outputs.values():
+            output.flush()
+            output.stream.flush()
+
+    def close(self):
+        for output in self.outputs.values():
+            output.close()
+        self.outputs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_knowledge_base(labels, path, compression=None, split_classes=False):
+    # every entity of a main.Labels graph, returns the number written
+    with KnowledgeBaseWriter(path, compression, split_classes) as writer:
+        writer.write_entities(labels.format_entity(entity) for entity in labels.get_entities_iter())
+    return writer.num_entities
+
+
+def read_knowledge_base(path):
+    # formatted entities of a file, or of a directory of split class files
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if '.jsonl' in name:
+                for entity in read_knowledge_base(os.path.join(path, name)):
+                    yield entity
+        return
+    with open_input(path) as fin:
+        for line in fin:
+            line = line.strip()
+            if line:
+                yield jsonio.loads(line)
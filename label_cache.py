@@ -0,0 +1,102 @@
+# binary cache of built episode graphs
+# every compact store is saved as .npy columns plus a json file of its string tables,
+# in one directory keyed by the paths, mtimes and sizes of the source files they were
+# built from. the columns are loaded as read-only memory maps, so the viewer, render
+# workers and query processes of an episode share one copy through the page cache
+
+import array
+import collections
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+import jsonio
+from entity_store import CompactEntities
+
+CACHE_VERSION = 4
+KEY_FILE = 'key'
+TABLES_SUFFIX = '.tables.json'
+
+
+def get_cache_key(paths, extra=None):
+    stamps = []
+    for path in paths:
+        stat = os.stat(path)
+        stamps.append([os.path.abspath(path), stat.st_mtime_ns, stat.st_size])
+    key = json.dumps([CACHE_VERSION, stamps, extra])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_array(values):
+    if isinstance(values, array.array):
+        return np.frombuffer(values, dtype=values.typecode)
+    return np.asarray(values)
+
+
+def save_graphs(graph_dir, graphs, key=''):
+    # graphs: name -> CompactEntities, written as <name>.<column>.npy and <name>.tables.json
+    tmp_dir = graph_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for name, store in graphs.items():
+        columns, tables = store.get_columns()
+        for column, values in columns.items():
+            np.save(os.path.join(tmp_dir, '%s.%s.npy' % (name, column)), get_array(values))
+        with open(os.path.join(tmp_dir, name + TABLES_SUFFIX), 'w') as fout:
+            json.dump(tables, fout)
+    with open(os.path.join(tmp_dir, KEY_FILE), 'w') as fout:
+        fout.write(key)
+
+    # swap in the new directory, so a reader never sees half a graph. processes that
+    # mapped the old columns keep reading their (unlinked) files
+    old_dir = graph_dir + '.old'
+    if os.path.exists(graph_dir):
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(graph_dir, old_dir)
+    os.rename(tmp_dir, graph_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def load_graphs(graph_dir, key=None, mmap_mode='r'):
+    # name -> CompactEntities reading the mapped columns, or None when the directory
+    # is missing or was built for another key. mmap_mode=None reads private copies
+    key_path = os.path.join(graph_dir, KEY_FILE)
+    if not os.path.exists(key_path):
+        return None
+    if key is not None:
+        with open(key_path) as fin:
+            if fin.read() != key:
+                return None
+
+    columns = collections.defaultdict(dict)
+    names = []
+    for file_name in sorted(os.listdir(graph_dir)):
+        if file_name.endswith(TABLES_SUFFIX):
+            names.append(file_name[:-len(TABLES_SUFFIX)])
+        elif file_name.endswith('.npy'):
+            name, column = file_name[:-len('.npy')].split('.', 1)
+            # plain ndarray views of the mapping, np.memmap indexing goes through python
+            values = np.load(os.path.join(graph_dir, file_name), mmap_mode=mmap_mode)
+            columns[name][column] = values.view(np.ndarray)
+    graphs = {}
+    for name in names:
+        tables = jsonio.load_json(os.path.join(graph_dir, name + TABLES_SUFFIX))
+        graphs[name] = CompactEntities.from_columns(columns[name], tables, copy=False)
+    return graphs
+
+
+def load_or_build(graph_dir, paths, build, extra=None):
+    # build() returns name -> CompactEntities and only runs when the cache is stale.
+    # the built graphs are saved and then mapped like a cached graph
+    key = get_cache_key(paths, extra)
+    graphs = load_graphs(graph_dir, key)
+    if graphs is None:
+        save_graphs(graph_dir, build(), key)
+        graphs = load_graphs(graph_dir, key)
+    return graphs
@@ -1,41 +1,108 @@
-import json
+import argparse
+import concurrent.futures
 import collections
 import sys
 import logging
 import math
-import jsonlines
+import time
 import cv2
+import numpy as np
+
+import jsonio
+import vocab
+from entity_store import CompactEntities
+from kb_writer import KnowledgeBaseWriter, write_knowledge_base
+from relation_caption import parse_caption
+from reorder import ReorderBuffer
+from spatial_index import BoxGrid
+from time_index import TimeIndex
 
 MERGE_TIME_WINDOW = 1.0
 MERGE_OVERLAP_THRESHOLD = 0.5
+OBJECT_BATCH_SIZE = 4096
+QUERY_CACHE_SIZE = 128
+STREAM_FLUSH_INTERVAL = 1.0  # seconds between flushes of a streamed knowledge base
+# ends of a new property whose object add_label may have changed in place
+QUERY_CHANGED_ENDS = {
+    vocab.LOCATED_AT: ('source',),
+    vocab.CORE_IDS['related_to_object']: ('source', 'target'),
+    vocab.CORE_IDS['subtitle_of']: ('source',),
+}
+# value fields holding vocabulary ids
+VOCAB_VALUE_KEYS = ('label', 'relation_kb', 'relation_obj')
+# abstract objects whose label is free text, kept as a string
+TEXT_CLASSES = ('subtitle',)
 
 logger = None
 
+def format_entity_id(entity_id):
+    # entity ids are integers internally: objects even, properties odd
+    if entity_id & 1:
+        return 'P%d' % (entity_id >> 1)
+    return 'O%d' % (entity_id >> 1)
+
 class Labels:
-    def __init__(self, merge_time_window=MERGE_TIME_WINDOW, merge_overlap_threshold=MERGE_OVERLAP_THRESHOLD):
+    def __init__(self, merge_time_window=MERGE_TIME_WINDOW, merge_overlap_threshold=MERGE_OVERLAP_THRESHOLD, spatial_index=True):
         self.entities = {}
         self.abstract_object_ids = collections.defaultdict(dict)
         self.coordinate_object_ids = collections.defaultdict(dict)
         self.located_at_property_ids = collections.defaultdict(list)
+        self.located_at_grids = collections.defaultdict(BoxGrid)
         self.video_entity_id = None
         self.ids = {}
+        # class, subclass and label strings are stored as ids of the shared base
+        # vocabulary, extended per graph with the strings it lacks
+        self.vocab = vocab.Vocabulary(base=vocab.get_base_vocabulary())
+        self.input_id_nodes = {}  # input id -> every entity it was merged into
         self.property_id = 0
         self.object_id = 0
         self.merge_time_window = merge_time_window
         self.merge_overlap_threshold = merge_overlap_threshold
+        self.time_index = None
+        # query() arguments -> (results, object ids examined), least recently used first
+        self.query_cache = collections.OrderedDict()
+        self.query_cache_size = QUERY_CACHE_SIZE
+        # node id -> property class -> property ids, for traversals
+        self.out_edges = {}
+        self.in_edges = {}
+        # the grid only prunes boxes without a positive overlap, which a
+        # negative threshold would still accept
+        self.spatial_index = spatial_index and merge_overlap_threshold >= 0
 
     def get_property_id(self):
         self.property_id += 1
-        return 'P%d' % self.property_id
+        return (self.property_id << 1) | 1
 
     def get_object_id(self):
         self.object_id += 1
-        return 'O%d' % self.object_id
+        return self.object_id << 1
+
+    def format_entity(self, entity):
+        # copy of the entity with O#/P# string ids and vocabulary strings, for output
+        strings = self.vocab.strings
+        formatted = dict(entity)
+        for key in ('id', 'source', 'target'):
+            if key in formatted:
+                formatted[key] = format_entity_id(formatted[key])
+        if 'class' in formatted:
+            formatted['class'] = strings[formatted['class']]
+        if 'value' in formatted:
+            value = formatted['value'] = dict(formatted['value'])
+            for key in VOCAB_VALUE_KEYS:
+                if type(value.get(key)) is int:
+                    value[key] = strings[value[key]]
+            if 'relation' in value:
+                value['relation'] = format_entity_id(value['relation'])
+        return formatted
 
     def get_entities_iter(self):
         for entity_id, entity in self.entities.items():
             yield entity
 
+    def compact(self):
+        # read-only columnar copy of the graph built so far
+        return CompactEntities.from_entities(map(self.format_entity, self.get_entities_iter()))
+
     def is_coordinates_mergeable(self, coord_a, coord_b):
         # [x, y, width, height]
         a_x, a_y, a_width, a_height = coord_a
@@ -53,16 +120,173 @@ class Labels:
 
     def add_entity(self, entity):
         self.entities[entity['id']] = entity
-        if entity['entity_type'] == 'property' and entity['class'] == 'located_at':
+        if entity['entity_type'] == 'property' and entity['class'] == vocab.LOCATED_AT:
             seconds = entity['value']['seconds']
             self.located_at_property_ids[math.floor(seconds)].append(entity['id'])
+            coordinates = self.entities[entity['target']]['value']['coordinates']
+            self.located_at_grids[math.floor(seconds)].add(coordinates, entity['id'])
+        if entity['entity_type'] == 'property':
+            self.index_edges(entity)
+        if self.time_index is not None:
+            self.time_index.add(entity)
+        if self.query_cache and entity['entity_type'] == 'property':
+            self.invalidate_queries(entity)
+
+    def build_time_index(self):
+        self.time_index = TimeIndex.build(self.get_entities_iter(), 'seconds')
+        return self.time_index
+
+    def entities_between(self, t0, t1, include_start=True, include_end=False):
+        if self.time_index is None:
+            self.build_time_index()
+        return self.time_index.between(t0, t1, include_start, include_end)
+
+    def invalidate_queries(self, prop):
+        # drop the cached windows a new property falls into, and those holding an object
+        # that was just relabeled or moved along with it
+        seconds = prop.get('value', {}).get('seconds')
+        changed = [prop[end] for end in QUERY_CHANGED_ENDS.get(prop['class'], ())]
+        for key, (results, object_ids) in list(self.query_cache.items()):
+            if (seconds is not None and key[0] <= seconds <= key[1]) or any(i in object_ids for i in changed):
+                del self.query_cache[key]
+
+    def add_input_id(self, entity, input_id):
+        entity.setdefault('input_ids', []).append(input_id)
+        self.ids[input_id] = entity['id']
+        self.input_id_nodes.setdefault(input_id, set()).add(entity['id'])
+        # the person filter of query() may now match the entity
+        for key, (results, object_ids) in list(self.query_cache.items()):
+            if entity['id'] in object_ids:
+                del self.query_cache[key]
+
+    def query(self, t0, t1, classes=None, person=None, include_start=True, include_end=False):
+        # properties between t0 and t1 joined with their source and target objects, optionally
+        # only of the given property classes and with the given person id on either side
+        # results are shared with the cache and must not be modified
+        if classes is not None:
+            # vocabulary ids, unknown names match nothing
+            classes = frozenset(self.vocab.get(name, -1) for name in ([classes] if isinstance(classes, str) else classes))
+        key = (t0, t1, include_start, include_end, classes, person)
+        if key in self.query_cache:
+            self.query_cache.move_to_end(key)
+            return list(self.query_cache[key][0])
+
+        results = []
+        object_ids = set()
+        for prop in self.entities_between(t0, t1, include_start, include_end):
+            if prop['entity_type'] != 'property' or (classes is not None and prop['class'] not in classes):
+                continue
+            source = self.entities.get(prop['source'], {'id': prop['source']})
+            target = self.entities.get(prop['target'], {'id': prop['target']})
+            # objects the person filter rejects are kept too, they may gain the input id later
+            object_ids.add(source['id'])
+            object_ids.add(target['id'])
+            if person is not None and person not in source.get('input_ids', ()) and person not in target.get('input_ids', ()):
+                continue
+            results.append({
+                'property': self.format_entity(prop),
+                'source': self.format_entity(source),
+                'target': self.format_entity(target),
+            })
+        self.query_cache[key] = (results, object_ids)
+        if len(self.query_cache) > self.query_cache_size:
+            self.query_cache.popitem(last=False)
+        return list(results)
+
+    def index_edges(self, prop):
+        # keyed by the shared class name, dicts with str keys are smaller than int keyed ones
+        prop_class = self.vocab.strings[prop['class']]
+        self.out_edges.setdefault(prop['source'], {}).setdefault(prop_class, []).append(prop['id'])
+        self.in_edges.setdefault(prop['target'], {}).setdefault(prop_class, []).append(prop['id'])
+
+    def resolve_nodes(self, node):
+        # an input id like 'person_ross_geller' names every entity it was merged into
+        if isinstance(node, str):
+            return sorted(self.input_id_nodes.get(node, ()))
+        return [node]
+
+    def edges(self, node, classes=None, direction='both', t0=None, t1=None):
+        # (property, neighbor id) of the properties leaving and/or entering a node,
+        # with t0 <= seconds <= t1 when a window is given
+        if isinstance(classes, str):
+            classes = [classes]
+        adjacency = []
+        for node_id in self.resolve_nodes(node):
+            if direction in ('out', 'both'):
+                adjacency.append((self.out_edges.get(node_id, {}), 'target'))
+            if direction in ('in', 'both'):
+                adjacency.append((self.in_edges.get(node_id, {}), 'source'))
+
+        result = []
+        for by_class, end in adjacency:
+            for prop_class in (by_class if classes is None else classes):
+                for prop_id in by_class.get(prop_class, ()):
+                    prop = self.entities.get(prop_id)
+                    if prop is None:
+                        continue
+                    if t0 is not None or t1 is not None:
+                        seconds = prop.get('value', {}).get('seconds')
+                        if seconds is None or (t0 is not None and seconds < t0) or (t1 is not None and seconds > t1):
+                            continue
+                    result.append((prop, prop[end]))
+        return result
+
+    def neighbors(self, node, classes=None, direction='both', t0=None, t1=None):
+        seen = set()
+        result = []
+        for prop, neighbor in self.edges(node, classes, direction, t0, t1):
+            if neighbor not in seen:
+                seen.add(neighbor)
+                result.append(neighbor)
+        return result
+
+    def k_hop(self, node, k, classes=None, direction='both', t0=None, t1=None):
+        # node id -> hops for every node within k hops
+        frontier = self.resolve_nodes(node)
+        hops = dict.fromkeys(frontier, 0)
+        for hop in range(1, k + 1):
+            next_frontier = []
+            for current in frontier:
+                for neighbor in self.neighbors(current, classes, direction, t0, t1):
+                    if neighbor not in hops:
+                        hops[neighbor] = hop
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        return hops
+
+    def find_path(self, source, target, classes=None, t0=None, t1=None, max_hops=None):
+        # shortest list of properties linking two nodes, ignoring edge direction, or None
+        frontier = self.resolve_nodes(source)
+        targets = set(self.resolve_nodes(target))
+        parents = dict.fromkeys(frontier)
+        found = next((node for node in frontier if node in targets), None)
+        hop = 0
+        while frontier and found is None and (max_hops is None or hop < max_hops):
+            next_frontier = []
+            for current in frontier:
+                for prop, neighbor in self.edges(current, classes, 'both', t0, t1):
+                    if neighbor not in parents:
+                        parents[neighbor] = (current, prop)
+                        next_frontier.append(neighbor)
+                        if found is None and neighbor in targets:
+                            found = neighbor
+            frontier = next_frontier
+            hop += 1
+        if found is None:
+            return None
+        path = []
+        node = found
+        while parents[node] is not None:
+            node, prop = parents[node]
+            path.append(prop)
+        return path[::-1]
 
     def get_video_object(self):
         if self.video_entity_id is None:
             entity = {
                 'entity_type': 'object',
                 'id': self.get_object_id(),
-                'class': 'video'
+                'class': vocab.VIDEO
             }
             self.video_entity_id = entity['id']
             self.add_entity(entity)
@@ -74,7 +298,12 @@ class Labels:
         range_start = max(math.floor(seconds) - math.ceil(self.merge_time_window), 0)
         range_end = math.ceil(seconds) + math.ceil(self.merge_time_window) + 1
         for i in range(range_start, range_end):
-            for prop_id in self.located_at_property_ids[i]:
+            if self.spatial_index:
+                grid = self.located_at_grids.get(i)
+                prop_ids = grid.candidates(coordinates) if grid is not None else []
+            else:
+                prop_ids = self.located_at_property_ids[i]
+            for prop_id in prop_ids:
                 prop = self.entities[prop_id]
                 time_mergeable = abs(prop['value']['seconds'] - seconds) <= self.merge_time_window
                 prop_coord = self.entities[prop['target']]
@@ -85,13 +314,16 @@ class Labels:
 
     def get_object_by_coord(self, seconds, coordinates):
         entity_id = self.get_entity_id_by_coord(seconds, coordinates)
+        return self.get_merged_object(entity_id)
+
+    def get_merged_object(self, entity_id):
         if entity_id is not None:
             return self.entities[entity_id]
         else:
             entity = {
                 'entity_type': 'object',
                 'id': self.get_object_id(),
-                'class': 'unknown'
+                'class': vocab.UNKNOWN
             }
             self.add_entity(entity)
             return entity
@@ -104,7 +336,7 @@ class Labels:
             if obj['id'] in self.ids :
                 obj_id = self.ids[obj['id']]
             else:
-                print('error: get_object.')
+                logger.error('Unknown object id %s in get_object' % obj['id'])
                 #for key, value in self.entities.items():
                 #    print(key, value)
                 #    obj_id = key
@@ -125,7 +357,7 @@ class Labels:
             obj = {
                 'entity_type': 'object',
                 'id': self.get_object_id(),
-                'class': 'video_box',
+                'class': vocab.VIDEO_BOX,
                 'value': {
                     'coordinates': coordinates,
                     'seconds': seconds
@@ -142,9 +374,9 @@ class Labels:
             obj = {
                 'entity_type': 'object',
                 'id': self.get_object_id(),
-                'class': object_class,
+                'class': self.vocab.intern(object_class),
                 'value': {
-                    'label': label
+                    'label': label if object_class in TEXT_CLASSES else self.vocab.intern(label)
                 }
             }
             self.add_entity(obj)
@@ -155,7 +387,7 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
@@ -170,7 +402,7 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
@@ -186,7 +418,7 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
@@ -201,7 +433,7 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
@@ -210,7 +442,6 @@ class Labels:
                 'person': source['input_ids'][0]
             }
         }
-        print(source['input_ids'][0])
         self.add_entity(prop_entity)
         return prop_entity
 
@@ -219,14 +450,14 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
                 'seconds': seconds['seconds'],
                 'source': source['input_ids'], # added by haeyong.k
                 'target': target['input_ids'], # added by haeyong.k
-                'relation_kb': seconds['subclass']  # added by haeyong.k
+                'relation_kb': self.vocab.intern(seconds['subclass'])  # added by haeyong.k
             }
         }
         self.add_entity(prop_entity)
@@ -236,7 +467,7 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
@@ -245,10 +476,9 @@ class Labels:
                 'source_coordinates' : source['value']['coordinates'], # added by haeyong.k
                 'target': target['input_ids'], # added by haeyong.k
                 'target_coordinates': target['value']['coordinates'], # added by haeyong.k
-                'relation_obj': seconds['subclass'] # added by haeyong.k
+                'relation_obj': self.vocab.intern(seconds['subclass']) # added by haeyong.k
             }
         }
-        print(prop_entity)
         self.add_entity(prop_entity)
         return prop_entity
 
@@ -256,7 +486,7 @@ class Labels:
         prop_entity = {
             'entity_type': 'property',
             'id': self.get_property_id(),
-            'class': object_class,
+            'class': self.vocab.intern(object_class),
             'source': source['id'],
             'target': target['id'],
             'value': {
@@ -266,25 +496,121 @@ class Labels:
         self.add_entity(prop_entity)
         return prop_entity
 
+    def set_object_label(self, entity, label):
+        # Overwrite the entity
+        entity['entity_type'] = 'object'
+        entity['class'] = self.vocab.intern(label['class'])
+        entity['value'] = {'label': self.vocab.intern(label['label'])}
+
+        if 'id' in label and label['id'] is not None:
+            self.add_input_id(entity, label['id'])
+
+        coord_entity = self.get_coordinate_object(label['seconds'], label['coordinates'])
+        return self.get_property(label['seconds'], 'located_at', entity, coord_entity)
+
+    def get_mergeable_matrix(self, seconds, boxes, cand_seconds, cand_boxes):
+        # [x, y, width, height], same arithmetic as is_coordinates_mergeable
+        a_x, a_y, a_width, a_height = [boxes[:, i, None] for i in range(4)]
+        b_x, b_y, b_width, b_height = [cand_boxes[None, :, i] for i in range(4)]
+        overlap_width = np.maximum(0, np.minimum(a_x + a_width, b_x + b_width) - np.maximum(a_x, b_x))
+        overlap_height = np.maximum(0, np.minimum(a_y + a_height, b_y + b_height) - np.maximum(a_y, b_y))
+        overlap_area = overlap_width * overlap_height
+        coord_mergeable = (overlap_area > a_width * a_height * self.merge_overlap_threshold) & \
+                          (overlap_area > b_width * b_height * self.merge_overlap_threshold)
+        time_mergeable = np.abs(cand_seconds[None, :] - seconds[:, None]) <= self.merge_time_window
+        return coord_mergeable & time_mergeable
+
+    def add_object_labels(self, batch, block_size=512):
+        # vectorized add_label for a batch of object labels, builds the same graph
+        # as adding them one by one: every label is tested against the existing
+        # located_at boxes and the earlier labels of the batch in one pass
+        n = len(batch)
+        if n == 0:
+            return
+        seconds = np.array([label['seconds'] for label in batch], dtype=np.float64)
+        boxes = np.array([label['coordinates'] for label in batch], dtype=np.float64).reshape(n, 4)
+        buckets = np.floor(seconds).astype(np.int64)
+        window = math.ceil(self.merge_time_window)
+        range_start = np.maximum(buckets - window, 0)
+        range_end = np.ceil(seconds).astype(np.int64) + window + 1
+
+        # existing located_at boxes within reach of the batch
+        cand_sources, cand_seconds, cand_boxes, cand_buckets, cand_pos = [], [], [], [], []
+        bucket_len = {}
+        for i in range(int(range_start.min()), int(range_end.max())):
+            prop_ids = self.located_at_property_ids.get(i, [])
+            bucket_len[i] = len(prop_ids)
+            for pos, prop_id in enumerate(prop_ids):
+                prop = self.entities[prop_id]
+                cand_sources.append(prop['source'])
+                cand_seconds.append(prop['value']['seconds'])
+                cand_boxes.append(self.entities[prop['target']]['value']['coordinates'])
+                cand_buckets.append(i)
+                cand_pos.append(pos)
+        num_existing = len(cand_sources)
+
+        # the batch labels themselves, appended to their buckets in order
+        for k in range(n):
+            b = int(buckets[k])
+            pos = bucket_len.get(b, len(self.located_at_property_ids.get(b, [])))
+            bucket_len[b] = pos + 1
+            cand_buckets.append(b)
+            cand_pos.append(pos)
+        cand_seconds = np.concatenate([np.array(cand_seconds, dtype=np.float64), seconds])
+        cand_boxes = np.concatenate([np.array(cand_boxes, dtype=np.float64).reshape(-1, 4), boxes])
+        cand_buckets = np.array(cand_buckets, dtype=np.int64)
+        order = np.lexsort((np.array(cand_pos, dtype=np.int64), cand_buckets))
+        cand_rank = np.empty_like(order)
+        cand_rank[order] = np.arange(len(order))
+
+        for block_start in range(0, n, block_size):
+            block = slice(block_start, min(block_start + block_size, n))
+            block_seconds = seconds[block]
+            reach = self.merge_time_window + 1
+            cols = np.flatnonzero((cand_seconds >= block_seconds.min() - reach) &
+                                  (cand_seconds <= block_seconds.max() + reach))
+            mergeable = self.get_mergeable_matrix(block_seconds, boxes[block], cand_seconds[cols], cand_boxes[cols])
+            col_buckets = cand_buckets[cols]
+            mergeable &= (col_buckets[None, :] >= range_start[block, None]) & \
+                         (col_buckets[None, :] < range_end[block, None])
+            # a label can only merge into labels of the batch added before it
+            col_batch = cols - num_existing
+            mergeable &= col_batch[None, :] < np.arange(block.start, block.stop)[:, None]
+            col_rank = cand_rank[cols]
+
+            for row, j in enumerate(range(block.start, block.stop)):
+                hits = np.flatnonzero(mergeable[row])
+                if len(hits):
+                    c = int(cols[hits[np.argmin(col_rank[hits])]])
+                    entity_id = cand_sources[c]
+                else:
+                    entity_id = None
+                entity = self.get_merged_object(entity_id)
+                self.set_object_label(entity, batch[j])
+                cand_sources.append(entity['id'])
+
+    def add_labels(self, labels):
+        # runs of object labels go through the batch path
+        batch = []
+        for label in labels:
+            if label['type'] == 'object':
+                batch.append(label)
+                if len(batch) >= OBJECT_BATCH_SIZE:
+                    self.add_object_labels(batch)
+                    batch = []
+            else:
+                if batch:
+                    self.add_object_labels(batch)
+                    batch = []
+                self.add_label(label)
+        if batch:
+            self.add_object_labels(batch)
+
     def add_label(self, label):
         new_entities = []
         if label['type'] == 'object' :
-            # Overwrite the entity
             entity = self.get_object_by_coord(label['seconds'], label['coordinates'])
-            entity['entity_type'] = 'object'
-            entity['class'] = label['class']
-            entity['value'] = {'label': label['label']}
-
-            if 'id' in label and label['id'] is not None:
-                if 'input_ids' not in entity:
-                    entity['input_ids'] = []
-                #entity['input_ids'].append(label['id'].split(' ')[0])
-                #self.ids[label['id'].split(' ')[0]] = entity['id']
-                entity['input_ids'].append(label['id'])
-                self.ids[label['id']] = entity['id']
-
-            coord_entity = self.get_coordinate_object(label['seconds'], label['coordinates'])
-            prop_entity = self.get_property(label['seconds'], 'located_at', entity, coord_entity)
+            prop_entity = self.set_object_label(entity, label)
 
         elif label['type'] == 'behavior':
             entity = self.get_object(label['seconds'], label['object'])
@@ -296,16 +622,11 @@ class Labels:
             # Overwrite the entity
             entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
             entity['entity_type'] = 'object'
-            entity['class'] = label['class']
-            entity['value'] = {'label': label['class']}
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': entity['class']}
 
             if 'id' in label['object'] and label['object']['id'] is not None:
-                if 'input_ids' not in entity:
-                    entity['input_ids'] = []
-                # entity['input_ids'].append(label['id'].split(' ')[0])
-                # self.ids[label['id'].split(' ')[0]] = entity['id']
-                entity['input_ids'].append(label['object']['id'])
-                self.ids[label['object']['id']] = entity['id']
+                self.add_input_id(entity, label['object']['id'])
 
             entity = self.get_object(label['seconds'], label['object'])
             emotion_entity = self.get_abstract_object('emotion', label['class'])
@@ -316,26 +637,20 @@ class Labels:
             # Overwrite the entity
             entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
             entity['entity_type'] = 'relation'
-            entity['class'] = label['class']
-            entity['value'] = {'label': label['class']}
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': entity['class']}
 
             if 'id' in label['source'] and label['source']['id'] is not None:
-                if 'input_ids' not in entity:
-                    entity['input_ids'] = []
-                entity['input_ids'].append(label['source']['id'])
-                self.ids[label['source']['id']] = entity['id']
+                self.add_input_id(entity, label['source']['id'])
 
             # Overwrite the entity
             entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
             entity['entity_type'] = 'relation'
-            entity['class'] = label['class']
-            entity['value'] = {'label': label['class']}
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': entity['class']}
 
             if 'id' in label['target'] and label['target']['id'] is not None:
-                if 'input_ids' not in entity:
-                    entity['input_ids'] = []
-                entity['input_ids'].append(label['target']['id'])
-                self.ids[label['target']['id']] = entity['id']
+                self.add_input_id(entity, label['target']['id'])
 
             source_entity = self.get_object(label['seconds'], label['source'])
             target_entity = self.get_object(label['seconds'], label['target'])
@@ -348,26 +663,20 @@ class Labels:
             # Overwrite the entity
             entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
             entity['entity_type'] = 'relation_object'
-            entity['class'] = label['class']
-            entity['value'] = {'label': label['class']}
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': entity['class']}
 
             if 'id' in label['source'] and label['source']['id'] is not None:
-                if 'input_ids' not in entity:
-                    entity['input_ids'] = []
-                entity['input_ids'].append(label['source']['id'])
-                self.ids[label['source']['id']] = entity['id']
+                self.add_input_id(entity, label['source']['id'])
 
             # Overwrite the entity
             entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
             entity['entity_type'] = 'relation_object'
-            entity['class'] = label['class']
-            entity['value'] = {'label': label['class']}
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': entity['class']}
 
             if 'id' in label['target'] and label['target']['id'] is not None:
-                if 'input_ids' not in entity:
-                    entity['input_ids'] = []
-                entity['input_ids'].append(label['target']['id'])
-                self.ids[label['target']['id']] = entity['id']
+                self.add_input_id(entity, label['target']['id'])
 
             source_entity = self.get_object(label['seconds'], label['source'])
             source_entity['value']['coordinates'] = label['source']['coordinates']
@@ -393,6 +702,149 @@ class Labels:
             entity['value']['id'] = label['id']
             prop_entity = self.get_subtitle_property(label['start_time'], 'subtitle_of', entity, video_entity)
 
+class StreamingLabels(Labels):
+    # Labels for an unbounded, time ordered label stream
+    # entities are passed to emit() with O#/P# ids once no later label can change them and are
+    # then dropped, so memory only holds the last merge_time_window seconds:
+    # - properties are emitted right away, located_at ones stay until their bucket is evicted
+    # - objects stay while one of their located_at buckets can still be merged into
+    # - abstract objects and the video object are shared by later labels, so they
+    #   are emitted by flush() at the end of the stream
+    def __init__(self, emit, merge_time_window=MERGE_TIME_WINDOW, merge_overlap_threshold=MERGE_OVERLAP_THRESHOLD, spatial_index=True):
+        super(StreamingLabels, self).__init__(merge_time_window, merge_overlap_threshold, spatial_index)
+        self.emit = emit
+        self.new_ids = []
+        self.emitted = set()       # emitted entities still held for merging
+        self.live_objects = {}     # object id -> last bucket of its located_at properties
+        self.shared_ids = set()    # abstract and video objects
+        self.cutoff = 0            # buckets below it can no longer be merged into
+
+    def add_entity(self, entity):
+        super(StreamingLabels, self).add_entity(entity)
+        self.new_ids.append(entity['id'])
+
+    def index_edges(self, prop):
+        # emitted entities are dropped, there is no graph left to traverse
+        pass
+
+    def get_abstract_object(self, object_class, label):
+        obj = super(StreamingLabels, self).get_abstract_object(object_class, label)
+        self.shared_ids.add(obj['id'])
+        return obj
+
+    def get_video_object(self):
+        obj = super(StreamingLabels, self).get_video_object()
+        self.shared_ids.add(obj['id'])
+        return obj
+
+    def get_object(self, seconds, obj):
+        # objects referenced by input id may already be emitted, later properties only need their id
+        if 'id' in obj and obj['id'] in self.ids and self.ids[obj['id']] not in self.entities:
+            return {'id': self.ids[obj['id']]}
+        return super(StreamingLabels, self).get_object(seconds, obj)
+
+    def add_label(self, label):
+        super(StreamingLabels, self).add_label(label)
+        self.settle()
+        seconds = label.get('seconds', label.get('start_time'))
+        if isinstance(seconds, (int, float)):
+            # a label at t reads the buckets from floor(t) - ceil(merge_time_window) on
+            cutoff = math.floor(seconds) - math.ceil(self.merge_time_window)
+            if cutoff > self.cutoff or math.floor(seconds) < self.cutoff:
+                self.cutoff = max(self.cutoff, cutoff)
+                self.evict()
+
+    def add_labels(self, labels):
+        for label in labels:
+            self.add_label(label)
+
+    def settle(self):
+        # emit what the last label created, unless it can still change
+        new_ids, self.new_ids = self.new_ids, []
+        objects = []
+        for entity_id in new_ids:
+            entity = self.entities[entity_id]
+            if entity['entity_type'] == 'property':
+                if entity['class'] == vocab.LOCATED_AT:
+                    source = entity['source']
+                    bucket = math.floor(entity['value']['seconds'])
+                    self.live_objects[source] = max(self.live_objects.get(source, bucket), bucket)
+                    self.emit_entity(entity, keep=True)
+                else:
+                    self.emit_entity(entity)
+            elif entity['class'] == vocab.VIDEO_BOX:
+                # coordinates of located_at properties, dropped with their bucket
+                self.emit_entity(entity, keep=True)
+            else:
+                objects.append(entity_id)
+        for entity_id in objects:
+            if entity_id not in self.shared_ids and entity_id not in self.live_objects:
+                self.emit_entity(self.entities[entity_id])
+
+    def emit_entity(self, entity, keep=False):
+        self.emit(self.format_entity(entity))
+        if keep:
+            self.emitted.add(entity['id'])
+        else:
+            del self.entities[entity['id']]
+
+    def drop_entity(self, entity_id):
+        self.emitted.discard(entity_id)
+        self.entities.pop(entity_id, None)
+
+    def evict(self):
+        self.query_cache.clear()
+        for bucket in [b for b in self.located_at_property_ids if b < self.cutoff]:
+            for prop_id in self.located_at_property_ids.pop(bucket):
+                self.drop_entity(prop_id)
+            self.located_at_grids.pop(bucket, None)
+        for seconds in [s for s in self.coordinate_object_ids if math.floor(s) < self.cutoff]:
+            for obj in self.coordinate_object_ids.pop(seconds).values():
+                self.drop_entity(obj['id'])
+        for entity_id in [i for i, bucket in self.live_objects.items() if bucket < self.cutoff]:
+            del self.live_objects[entity_id]
+            self.emit_entity(self.entities[entity_id])
+
+    def flush(self):
+        # end of the stream, emit everything still held
+        for entity_id, entity in list(self.entities.items()):
+            if entity_id not in self.emitted:
+                self.emit(self.format_entity(entity))
+        self.entities.clear()
+        self.emitted.clear()
+        self.live_objects.clear()
+        self.located_at_property_ids.clear()
+        self.located_at_grids.clear()
+        self.coordinate_object_ids.clear()
+
+def stream_labels(labels_iter, writer, watermark=None, merge_time_window=MERGE_TIME_WINDOW, merge_overlap_threshold=MERGE_OVERLAP_THRESHOLD):
+    # writes the knowledge base of a label stream to a KnowledgeBaseWriter while reading it,
+    # labels up to watermark seconds out of order are put back in time order first.
+    # the writer buffers blocks, it is flushed every STREAM_FLUSH_INTERVAL seconds for live readers
+    def on_late(label, lag):
+        logger.debug('Label %.3f sec behind the released stream: %s' % (lag, label))
+
+    buffer = None
+    if watermark:
+        buffer = ReorderBuffer(watermark, on_late=on_late)
+        labels_iter = buffer.reorder(labels_iter)
+
+    labels = StreamingLabels(writer.write, merge_time_window, merge_overlap_threshold)
+    last_flush = time.monotonic()
+    for label in labels_iter:
+        labels.add_label(label)
+        now = time.monotonic()
+        if now - last_flush >= STREAM_FLUSH_INTERVAL:
+            writer.flush()
+            last_flush = now
+    labels.flush()
+    writer.flush()
+
+    if buffer is not None and buffer.num_late:
+        logger.warning('%d labels arrived after the %.1f sec watermark (up to %.3f sec late)' % (
+            buffer.num_late, watermark, buffer.max_lag))
+    return labels
+
 def init_logger():
     global logger
     logger = logging.getLogger('builder_main')
@@ -412,20 +864,77 @@ def init_logger():
     logger.addHandler(console_handler)
 
 def get_labels_iter():
-    #with open('./test_input.jsonlines') as f:
-    #    df = json.load(f)
-    with jsonlines.open('./test_input.jsonlines') as reader:
-        for obj in reader:
-            print(obj)
-
     for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
         try:
-            yield json.loads(line)
-        except json.decoder.JSONDecodeError:
-            logger.warn('Failed to decode JSON line: %s' % line.strip())
+            yield jsonio.loads(line)
+        except jsonio.DecodeError:
+            logger.warn('Failed to decode JSON line: %s' % line)
+
+def get_relation_object_label(obj):
+    obj['type'] = 'relation_object'
+    source_id, predicate, target_id = parse_caption(obj['caption'])
+    obj['source']['id'] = source_id
+    obj['target']['id'] = target_id
+    obj['class'] = 'related_to_object'
+    if 'subclass' not in obj:
+        obj['subclass'] = predicate
+    return obj
+
+def read_source(path, kind):
+    # parse one jsonl source into a list of labels, in a worker process with --workers > 1
+    labels = []
+    for obj in jsonio.iter_jsonl(path):
+        if kind == 'relation_object':
+            obj = get_relation_object_label(obj)
+        elif kind == 'subtitle' and 'type' not in obj:
+            obj['type'] = 'subtitle'
+        labels.append(obj)
+    return labels
+
+def load_sources(labels, sources, workers=1):
+    # sources are parsed in this process by default: the parsed labels are as costly
+    # to unpickle from a worker as to parse, so a pool only pays off when parsing is
+    # slow. with workers > 1 (None: one per core) they are parsed in parallel but
+    # merged in list order, so the graph is the same as reading them one after another
+    if workers is not None and workers <= 1:
+        for path, kind in sources:
+            labels.add_labels(read_source(path, kind))
+        return labels
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(read_source, path, kind) for path, kind in sources]
+        for future in futures:
+            labels.add_labels(future.result())
+    return labels
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes parsing the input sources (default: 1, parse in this process)')
+    parser.add_argument('--stream', action='store_true',
+                        help='read labels from stdin and write the knowledge base to stdout as it is built')
+    parser.add_argument('--watermark', type=float, default=10.0,
+                        help='seconds a streamed label may arrive out of order, 0 to disable')
+    parser.add_argument('--output', default='-',
+                        help='knowledge base file, - for stdout; .gz and .zst outputs are compressed')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None,
+                        help='compress the output (default: from the file extension)')
+    parser.add_argument('--split-classes', action='store_true',
+                        help='write one <class>.jsonl file per entity class into the --output directory')
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     init_logger()
+    if args.stream:
+        with KnowledgeBaseWriter(args.output, args.compression, args.split_classes) as writer:
+            stream_labels(get_labels_iter(), writer, args.watermark)
+        logger.info('%d entities written to %s' % (writer.num_entities, args.output))
+        return
+
     labels = Labels()
 
     #line = 0
@@ -451,88 +960,22 @@ def main():
     subtitle_file = 's01_e' + episode + '.jsonl'
     subtitle = './../tracking/subtitle/' + subtitle_file
 
-    with jsonlines.open(place) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(sound) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(tracking) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(action) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(emotion) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(relation_kbb) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(relation_kbh) as reader:
-        for obj in reader:
-            labels.add_label(obj)
-
-    with jsonlines.open(relation_object) as reader:
-        for obj in reader:
-            obj['type'] = 'relation_object'
-            obj['source']['id'] = obj['caption'].split(' ')[0] + '_' + obj['caption'].split(' ')[1]
-            target = ''
-            for word in obj['caption'].split(' ')[3:]:
-                if '_' in target:
-                    target = target + '_' + word
-                else:
-                    target = word
-            obj['target']['id'] = target
-            obj['class'] = 'related_to_object'
-            if 'subclass' not in obj:
-                obj['subclass'] = obj['caption'].split(' ')[2]
-                #print(obj['subclass'])
-            labels.add_label(obj)
-
-    with jsonlines.open(subtitle) as reader:
-        for obj in reader:
-            if 'type' not in obj:
-                obj['type'] = 'subtitle'
-            labels.add_label(obj)
-
-    place = []
-    for entity in labels.get_entities_iter():
-        if 'value' in entity:
-            if 'seconds' in entity['value']:
-                #print(json.dumps(entity['value']['seconds']))
-                place.append(entity)
-            else:
-                pass
-        else:
-            pass
-            #print(json.dumps(entity['value']['seconds']))
-
-    # find the dictionary by time
-    results = list(filter(lambda  x : x['value']['seconds'] > 1.0 and x['value']['seconds'] < 50.0 , place))
-
-    for d in results:
-        print(d)
-    print('done.')
-
-    season = 1
-    episode = 1
-    frame_number = 100
-    bbox_fpath = "./../tracking/person/S{:02d}_EP{:02d}/{:05d}.json".format(season, episode, frame_number)
-    with open(bbox_fpath, 'r') as fin:
-        bboxes = json.load(fin)
-    bboxes = [bbox for bbox in bboxes if bbox['confidence'] > 0.5 and bbox['label'] == 'person']
-    for bbox in bboxes:
-        x1, y1 = bbox['topleft']['x'], bbox['topleft']['y']
-        x2, y2 = bbox['bottomright']['x'], bbox['bottomright']['y']
-
-        print('x1:', str(x1), 'y1:', str(y1), 'x2:', str(x2), 'y2:', str(y2))
+    # merged in this order, also when parsed by --workers processes
+    sources = [
+        (place, 'label'),
+        (sound, 'label'),
+        (tracking, 'label'),
+        (action, 'label'),
+        (emotion, 'label'),
+        (relation_kbb, 'label'),
+        (relation_kbh, 'label'),
+        (relation_object, 'relation_object'),
+        (subtitle, 'subtitle'),
+    ]
+    load_sources(labels, sources, args.workers)
+
+    num_entities = write_knowledge_base(labels, args.output, args.compression, args.split_classes)
+    logger.info('%d entities written to %s' % (num_entities, args.output))
 
 if __name__ == '__main__':
     main()
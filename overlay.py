@@ -0,0 +1,208 @@
+# overlays of the two viewer panes, shared by the kivy viewer and the headless renderer
+# the left pane shows the per-second labels (place, sound, object relations),
+# the right pane the per-frame boxes (tracked persons, emotions).
+# OverlaySchedule compiles the label graphs into one prebuilt entry per frame,
+# so drawing a frame is a lookup instead of a query and string building
+
+import collections
+
+import cv2
+import numpy as np
+
+
+def draw_person_boxes(frame, person_frames, frame_number):
+    # person detections of a packed json/tracking/person store, returns the drawn boxes
+    bboxes = person_frames.frame(frame_number)
+    #bboxes = bboxes[(bboxes['confidence'] > 0.5) & (bboxes['label'] == person_frames.string_ids.get('person', -1))]
+    bboxes = bboxes[bboxes['label'] == person_frames.string_ids.get('person', -1)]
+    for bbox in bboxes:
+        x1, y1 = int(bbox['x1']), int(bbox['y1'])
+        x2, y2 = int(bbox['x2']), int(bbox['y2'])
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 3)
+    return bboxes
+
+
+def draw_text_line(frame, text, line):
+    # line 1 is the place, line 2 the sound
+    cv2.putText(frame, text, (10, 50 * line), cv2.FONT_HERSHEY_PLAIN, 2, (0, 255, 0))
+
+
+def draw_object_relation(frame, source, target):
+    # source and target object bboxes
+    cv2.rectangle(frame, (source[0], source[1]), (source[2], source[3]), (255, 0, 0), 2)
+    cv2.rectangle(frame, (target[0], target[1]), (target[2], target[3]), (0, 0, 255), 2)
+
+
+def get_relation_captions(relation_frames, frame_number):
+    # captions about men and women of a packed json/tracking/relation_obj frame, at most 3 of each
+    strings = relation_frames.strings
+    bboxes_obj_cap = []
+    man_cnt = 0
+    woman_cnt = 0
+    for boxes in relation_frames.frame(frame_number):
+        if man_cnt >= 3:
+            break
+        if woman_cnt >= 3:
+            break
+
+        caption = strings[boxes['caption']]
+        if caption.find("man") >= 1 or caption.find("woman") >= 1 :
+            bboxes_obj_cap.append(caption)
+
+            if caption.find("man") >= 1:
+                man_cnt += 1
+            if caption.find("woman") >= 1:
+                woman_cnt += 1
+
+    captions = ''
+    for cap in bboxes_obj_cap:
+        if '\n' in captions:
+            captions = captions + cap + '\n'
+        else:
+            captions = cap + '\n'
+    return captions
+
+
+def get_event_text(value):
+    es = 'language extension'
+    for event in value['verbs'] :
+        #event['verb_num']
+        #event['verb']
+        #event['wn_synset_num']
+        #event['esf_type']
+        for e in event['esf']:
+            if e['se_type'] == 'pre-state':
+                es += 'pre-state:' + e['se_form'] + '\n'
+            elif e['se_type'] == 'process':
+                es = 'process:' + e['se_form']  + '\n'
+            #elif e['se_type'] == 'post-state':
+            #    es += 'post-state:' + e['se_form']  + '\n'
+    return es
+
+
+# what the viewer shows at one frame
+#   texts: (widget name, text, color) of the viewer labels to set
+#   boxes: (n, 4) emotion boxes of the right pane
+#   lines: (text, line) drawn on the left pane
+#   relation_boxes: (n, 2, 4) source and target boxes of object relations, left pane
+FrameOverlay = collections.namedtuple('FrameOverlay', ['texts', 'boxes', 'lines', 'relation_boxes'])
+
+NO_BOXES = np.zeros((0, 4), dtype=np.int32)
+NO_RELATION_BOXES = np.zeros((0, 2, 4), dtype=np.int32)
+
+
+def compile_frame_results(texts, results):
+    # per-frame labels of LabelsFrame, returns the emotion boxes
+    boxes = []
+    for result in results:
+        value = result['value']
+        if result['class'] == 'emotion':
+            texts['emotion_label'] = ('emotion: ' + str(value['id']) + '_' + value['classes'], (1, 0, 1, 1))
+            boxes.append(value['coordinates'][:4])
+        elif result['class'] == 'behavior':
+            texts['behavior_label'] = ('behavior: ' + value['classes'], (1, 0, 1, 1))
+    return np.array(boxes, dtype=np.int32).reshape(-1, 4) if boxes else NO_BOXES
+
+
+def compile_second_results(results):
+    # per-second labels of Labels, the same for every frame of the second
+    texts = {}
+    lines = []
+    relation_boxes = []
+    for result in results:
+        value = result['value']
+        if result['class'] == 'location_of':
+            texts['place_label'] = ('place: ' + value['label'], (1, 0, 1, 1))
+            lines.append((texts['place_label'][0], 1))
+        elif result['class'] == 'sound_of':
+            texts['sound_label'] = ('sound: ' + value['label'], (1, 0.5, 0.5, 1))
+            lines.append((texts['sound_label'][0], 2))
+        elif result['class'] == 'subtitle_of':
+            texts['subtitle'] = (value['id'] + ': ' + value['label'], (1, 0.5, 0.5, 1))
+        elif result['class'] == 'event_of':
+            texts['event'] = (get_event_text(value), (1, 0.5, 0.5, 1))
+        elif result['class'] == 'do':
+            texts['behavior_label'] = ('behavior: ' + value['label'], (1, 0, 1, 1))
+        elif result['class'] == 'feel':
+            texts['emotion_label'] = ('emotion: ' + value['person'] + '_' + value['label'], (1, 0, 1, 1))
+        # relations
+        elif result['class'] == 'related_to':
+            texts['relation_kbb'] = ('knowlege_base: ' + value['source'][0] + ' <--> ' +
+                                     value['relation_kb'] + ' <--> ' + value['target'][0], (1, 0, 0, 1))
+        elif result['class'] == 'related_to_object':
+            # the text is the frame's captions, filled in per frame
+            texts['relation_obj'] = (None, (1, 0, 0, 1))
+            relation_boxes.append([value['source_coordinates'][:4], value['target_coordinates'][:4]])
+    if relation_boxes:
+        relation_boxes = np.array(relation_boxes, dtype=np.float64).astype(np.int32)
+    else:
+        relation_boxes = NO_RELATION_BOXES
+    return texts, tuple(lines), relation_boxes
+
+
+class OverlaySchedule:
+    # dense per-frame table of the viewer overlays, compiled once from the label graphs
+    def __init__(self, entries):
+        self.entries = entries
+        self.empty = FrameOverlay((), NO_BOXES, (), NO_RELATION_BOXES)
+
+    @classmethod
+    def compile(cls, labels, labels_frames, num_frames, frame_rate=5, relation_frames=None):
+        seconds = {}
+        entries = []
+        for frame_number in range(num_frames + 1):
+            second = int(frame_number / frame_rate)
+            if second not in seconds:
+                seconds[second] = compile_second_results(labels.entities_between(second, second + 1.0))
+            second_texts, lines, relation_boxes = seconds[second]
+
+            # applied in the order of the viewer, the last text of a label wins
+            texts = {}
+            captions = ''
+            if relation_frames is not None:
+                captions = get_relation_captions(relation_frames, frame_number)
+                texts['relation_obj'] = (captions, (1, 0, 0, 1))
+            boxes = compile_frame_results(texts, labels_frames.entities_at_frame(frame_number))
+            texts['second_label'] = ('second: ' + str(second) + ', frame: ' + str(frame_number), (1, 1, 1, 1))
+            for name, (text, color) in second_texts.items():
+                texts[name] = (captions if text is None else text, color)
+
+            entries.append(FrameOverlay(tuple((name, text, color) for name, (text, color) in texts.items()),
+                                        boxes, lines, relation_boxes))
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, frame_number):
+        if 0 <= frame_number < len(self.entries):
+            return self.entries[frame_number]
+        return self.empty
+
+
+def has_left_overlay(entry, object_relation=False):
+    return bool(entry.lines) or (object_relation and len(entry.relation_boxes) > 0)
+
+
+def draw_right_overlay(frame, entry):
+    for x1, y1, x2, y2 in entry.boxes.tolist():
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+
+
+def draw_left_overlay(frame_left, entry, object_relation=False):
+    for text, line in entry.lines:
+        draw_text_line(frame_left, text, line)
+    if object_relation:
+        for source, target in entry.relation_boxes.tolist():
+            draw_object_relation(frame_left, source, target)
+
+
+def render_frame(frame, frame_number, schedule, person_frames=None, object_relation=False):
+    # (left, right) panes of a frame as shown by the viewer, the right pane is drawn in place
+    entry = schedule[frame_number]
+    frame_left = frame.copy()
+    if person_frames is not None:
+        draw_person_boxes(frame, person_frames, frame_number)
+    draw_right_overlay(frame, entry)
+    draw_left_overlay(frame_left, entry, object_relation)
+    return frame_left, frame
@@ -0,0 +1,103 @@
+# parser for the captions of relation_object records, e.g. "the man wearing black shirt"
+# a caption is a two word subject, a predicate and the object; the predicate is the
+# longest phrase of the captioner's relation vocabulary (json/object/vocab_pred_relation.txt)
+# after the subject, matched token by token in a trie. source and target ids follow the
+# original split based parse. captions repeat across frames, so recent captions are
+# kept parsed in a bounded cache
+
+import collections
+import os
+import sys
+
+VOCAB_PATH = './json/object/vocab_pred_relation.txt'
+SUBJECT_TOKENS = 2
+END = None  # trie key marking the end of a predicate
+CACHE_SIZE = 4096  # parsed captions kept, an episode has a few hundred distinct ones
+
+
+class CaptionParser:
+    def __init__(self, predicates=(), cache_size=CACHE_SIZE):
+        self.trie = {}
+        # least recently used first, caption -> (source id, predicate, target id)
+        self.cache = collections.OrderedDict()
+        self.cache_size = cache_size
+        for predicate in predicates:
+            self.add(predicate)
+
+    @classmethod
+    def from_file(cls, path=VOCAB_PATH):
+        # without the vocabulary every caption takes the legacy parse
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(f)
+
+    def add(self, predicate):
+        tokens = predicate.lower().split()
+        if not tokens:
+            return
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[END] = True
+
+    def match(self, tokens, start):
+        # end of the longest predicate starting at tokens[start] that leaves an object, or None
+        node = self.trie
+        end = None
+        for i in range(start, len(tokens) - 1):
+            node = node.get(tokens[i].lower())
+            if node is None:
+                break
+            if END in node:
+                end = i + 1
+        return end
+
+    def parse(self, caption):
+        parsed = self.cache.get(caption)
+        if parsed is not None:
+            self.cache.move_to_end(caption)
+            return parsed
+        parsed = self.cache[caption] = self.parse_tokens(caption.split(' '))
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return parsed
+
+    def parse_tokens(self, tokens):
+        source = '_'.join(tokens[:SUBJECT_TOKENS])
+        end = self.match(tokens, SUBJECT_TOKENS)
+        if end is not None:
+            predicate = ' '.join(tokens[SUBJECT_TOKENS:end])
+        else:
+            predicate = tokens[SUBJECT_TOKENS] if len(tokens) > SUBJECT_TOKENS else ''
+        # target ids keep the original rule whatever the predicate, so an object gets
+        # the same id in every caption and in knowledge bases built before the parser
+        target = get_legacy_target(tokens[SUBJECT_TOKENS + 1:])
+        return sys.intern(source), sys.intern(predicate), sys.intern(target)
+
+
+def get_legacy_target(words):
+    # target of the original split based parse
+    target = ''
+    for word in words:
+        if '_' in target:
+            target = target + '_' + word
+        else:
+            target = word
+    return target
+
+
+parser = None
+
+
+def get_parser():
+    # one parser per process, the vocabulary is read on first use
+    global parser
+    if parser is None:
+        parser = CaptionParser.from_file()
+    return parser
+
+
+def parse_caption(caption):
+    # (source id, predicate, target id) of a caption
+    return get_parser().parse(caption)
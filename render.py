@@ -0,0 +1,162 @@
+# renders the annotated viewer panes of episodes without a display
+#   $ python render.py --season 1 --episode 1 --output-dir ./render
+#   $ python render.py --season 1 --episode 1 2 3 --video --workers 8
+# frames are split into chunks, one chunk per task of a process pool; annotated
+# frames are written by the workers, videos are written in frame order by the parent
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import frame_store
+import overlay
+from viewer_labels import get_episode_sources, load_episode_graphs
+
+# (season, episode) -> (schedule, person_frames) of a worker process
+episode_state = {}
+
+
+def get_frame_numbers(frames_dir):
+    names = [os.path.splitext(name)[0] for name in os.listdir(frames_dir) if name.endswith('.jpg')]
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def get_person_frames(tracking_dir, season, episode):
+    json_dir = os.path.join(tracking_dir, 'person', 'S{:02d}_EP{:02d}'.format(season, episode))
+    if not os.path.isdir(json_dir):
+        return None
+    return frame_store.load_or_pack(json_dir, frame_store.get_packed_path('./cache', 'person', season, episode),
+                                    'person')
+
+
+def get_episode_state(season, episode, sources, tracking_dir, num_frames, frame_rate):
+    key = (season, episode)
+    if key not in episode_state:
+        graphs = load_episode_graphs(season, episode, sources)
+        schedule = overlay.OverlaySchedule.compile(graphs['labels'], graphs['labels_frames'], num_frames, frame_rate)
+        episode_state[key] = (schedule, get_person_frames(tracking_dir, season, episode))
+    return episode_state[key]
+
+
+def render_chunk(season, episode, sources, frames_dir, tracking_dir, num_frames, frame_numbers, frame_rate,
+                 object_relation, output_dir=None):
+    # annotated frames of the chunk, written to output_dir or returned in order
+    schedule, person_frames = get_episode_state(season, episode, sources, tracking_dir, num_frames, frame_rate)
+    rendered = []
+    for frame_number in frame_numbers:
+        frame = cv2.imread(os.path.join(frames_dir, '{:05d}.jpg'.format(frame_number)))
+        if frame is None:
+            continue
+        frame_left, frame = overlay.render_frame(frame, frame_number, schedule, person_frames, object_relation)
+        image = np.hstack([frame_left, frame])
+        if output_dir is None:
+            rendered.append(image)
+        else:
+            cv2.imwrite(os.path.join(output_dir, '{:05d}.jpg'.format(frame_number)), image)
+            rendered.append(frame_number)
+    return rendered
+
+
+def render_episode(executor, args, season, episode):
+    name = 'friends_s{:02d}_e{:02d}'.format(season, episode)
+    frames_dir = os.path.join(args.frames_dir, 'S{:02d}_EP{:02d}'.format(season, episode))
+    if not os.path.isdir(frames_dir):
+        print('%s: no frames in %s' % (name, frames_dir), file=sys.stderr)
+        return 0
+
+    # missing sources are skipped, the graphs and packed boxes are built once here
+    # so the workers only load them
+    sources = get_episode_sources(season, episode, sound=args.sound, emotion=args.emotion, behave=args.behave)
+    sources = [source for source in sources if os.path.exists(source[0])]
+    load_episode_graphs(season, episode, sources)
+    get_person_frames(args.tracking_dir, season, episode)
+
+    # the viewer starts at the second frame
+    frame_numbers = [f for f in get_frame_numbers(frames_dir) if f > 1]
+    chunks = [frame_numbers[i:i + args.chunk_size] for i in range(0, len(frame_numbers), args.chunk_size)]
+    task_args = (season, episode, sources, frames_dir, args.tracking_dir, max(frame_numbers, default=0))
+    task_options = (args.frame_rate, args.object_relation)
+
+    if not args.video:
+        output_dir = os.path.join(args.output_dir, name)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        futures = [executor.submit(render_chunk, *task_args, chunk, *task_options, output_dir=output_dir)
+                   for chunk in chunks]
+        return sum(len(future.result()) for future in futures)
+
+    # chunks are submitted a few at a time so at most that many rendered chunks wait in memory
+    video_path = os.path.join(args.output_dir, name + '.mp4')
+    writer = None
+    num_frames = 0
+    pending = collections.deque()
+    chunks = iter(chunks)
+    while True:
+        while len(pending) < args.max_pending:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            pending.append(executor.submit(render_chunk, *task_args, chunk, *task_options))
+        if not pending:
+            break
+        for image in pending.popleft().result():
+            if writer is None:
+                height, width = image.shape[:2]
+                writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*args.fourcc), args.fps, (width, height))
+            writer.write(image)
+            num_frames += 1
+    if writer is not None:
+        writer.release()
+    return num_frames
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='render annotated frames or videos of episodes')
+    parser.add_argument('--season', type=int, default=1)
+    parser.add_argument('--episode', type=int, nargs='+', default=[1])
+    parser.add_argument('--frames-dir', default='./frames')
+    parser.add_argument('--tracking-dir', default='./json/tracking')
+    parser.add_argument('--output-dir', default='./render')
+    parser.add_argument('--video', action='store_true', help='encode one video per episode instead of images')
+    parser.add_argument('--fps', type=float, default=5.0, help='frame rate of the encoded video')
+    parser.add_argument('--fourcc', default='mp4v')
+    parser.add_argument('--frame-rate', type=int, default=5, help='frames per labelled second, as in the viewer')
+    parser.add_argument('--object-relation', action='store_true', help='draw the object relation boxes')
+    parser.add_argument('--no-sound', dest='sound', action='store_false', help='leave out the sound events')
+    parser.add_argument('--no-emotion', dest='emotion', action='store_false', help='leave out the emotions')
+    parser.add_argument('--no-behave', dest='behave', action='store_false', help='leave out the behaviors')
+    parser.add_argument('--chunk-size', type=int, default=32, help='frames rendered per task')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: number of cores)')
+    args = parser.parse_args()
+    args.max_pending = 2 * (args.workers or os.cpu_count() or 1)
+    return args
+
+
+def main_render():
+    args = parse_args()
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    start = time.time()
+    total_frames = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for episode in args.episode:
+            episode_start = time.time()
+            num_frames = render_episode(executor, args, args.season, episode)
+            total_frames += num_frames
+            print('friends_s{:02d}_e{:02d}: {} frames in {:.1f} sec'.format(
+                args.season, episode, num_frames, time.time() - episode_start), file=sys.stderr)
+
+    elapsed = time.time() - start
+    print('%d frames in %.1f sec (%.1f frames/sec)' % (total_frames, elapsed, total_frames / elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main_render()
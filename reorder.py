@@ -0,0 +1,70 @@
+# watermark reorder buffer for live label streams
+# recognizers report labels with their own latencies, so a combined stream is
+# only roughly sorted; labels are held until they are `watermark` seconds older
+# than the newest label seen and then released in time order
+
+import heapq
+import itertools
+
+
+def get_label_seconds(label):
+    seconds = label.get('seconds', label.get('start_time'))
+    return seconds if isinstance(seconds, (int, float)) else None
+
+
+class ReorderBuffer:
+    def __init__(self, watermark=10.0, key=get_label_seconds, on_late=None):
+        self.watermark = watermark
+        self.key = key
+        self.on_late = on_late      # on_late(label, lag) for labels older than what was released
+        self.heap = []              # (seconds, arrival, label)
+        self.arrivals = itertools.count()
+        self.newest = None          # newest label time seen
+        self.released = None        # time of the last released label
+        self.num_late = 0
+        self.max_lag = 0.0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, label):
+        # labels that can be released now, in time order
+        seconds = self.key(label)
+        if seconds is None:
+            # untimed labels do not take part in merging, pass them on
+            return [label]
+        if self.released is not None and seconds < self.released:
+            # too late to be put in order, still released so nothing is lost
+            lag = self.released - seconds
+            self.num_late += 1
+            self.max_lag = max(self.max_lag, lag)
+            if self.on_late is not None:
+                self.on_late(label, lag)
+            return [label]
+
+        heapq.heappush(self.heap, (seconds, next(self.arrivals), label))
+        if self.newest is None or seconds > self.newest:
+            self.newest = seconds
+        return self.pop_until(self.newest - self.watermark)
+
+    def pop_until(self, seconds):
+        released = []
+        while self.heap and self.heap[0][0] <= seconds:
+            self.released, _, label = heapq.heappop(self.heap)
+            released.append(label)
+        return released
+
+    def flush(self):
+        # end of the stream, everything still held in time order
+        released = []
+        while self.heap:
+            self.released, _, label = heapq.heappop(self.heap)
+            released.append(label)
+        return released
+
+    def reorder(self, labels):
+        for label in labels:
+            for released in self.push(label):
+                yield released
+        for released in self.flush():
+            yield released
@@ -0,0 +1,263 @@
+# asyncio ingest server for live recognizer streams
+#   $ python server.py --unix /tmp/viz-graph.sock
+#   $ nc -U /tmp/viz-graph.sock < action.jsonl
+# every connection sends JSON lines: labels (as read by main.py) go into one shared
+# Labels graph, query lines are answered on the same connection while ingest goes on
+#   {"source": "action"}                    names the connection for the counters
+#   {"query": "between", "t0": 1.0, "t1": 5.0}
+#   {"query": "window", "t0": 1.0, "t1": 5.0, "classes": ["feel"], "person": "person_ross_geller"}
+#   {"query": "neighbors", "node": "person_ross_geller", "k": 2, "classes": ["related_to"]}
+#   {"query": "path", "source": "person_ross_geller", "target": "person_rachel_green", "t0": 0, "t1": 60}
+#   {"query": "entity", "id": "O12"}
+#   {"query": "stats"}
+
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+
+import jsonio
+import kb_writer
+import main
+from reorder import ReorderBuffer, get_label_seconds
+
+
+def parse_entity_id(entity_id):
+    # 'O12' -> internal integer id of main.Labels
+    if not isinstance(entity_id, str) or entity_id[:1] not in ('O', 'P') or not entity_id[1:].isdigit():
+        return None
+    return (int(entity_id[1:]) << 1) | (1 if entity_id[0] == 'P' else 0)
+
+
+def get_node(node):
+    # O#/P# entity ids or input ids like 'person_ross_geller'
+    entity_id = parse_entity_id(node)
+    return node if entity_id is None else entity_id
+
+
+class SourceStats:
+    def __init__(self):
+        self.connections = 0
+        self.lines = 0
+        self.labels = 0       # labels queued
+        self.added = 0        # labels added to the graph
+        self.errors = 0       # undecodable lines, labels the graph rejected and failed queries
+        self.late = 0         # labels behind the watermark
+        self.queries = 0
+        self.started = time.time()
+
+    def to_dict(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            'connections': self.connections,
+            'lines': self.lines,
+            'labels': self.labels,
+            'added': self.added,
+            'errors': self.errors,
+            'late': self.late,
+            'queries': self.queries,
+            'labels_per_sec': self.labels / elapsed,
+        }
+
+
+class IngestServer:
+    def __init__(self, labels, queue_size=10000, watermark=10.0):
+        self.labels = labels
+        self.labels.build_time_index()
+        # readers wait on a full queue, which stops reading their socket
+        self.queue = asyncio.Queue(queue_size)
+        self.buffer = None
+        if watermark:
+            self.buffer = ReorderBuffer(watermark, key=lambda item: get_label_seconds(item[1]), on_late=self.on_late)
+        self.sources = {}
+        self.connections = {}  # writer -> handler task of open connections, closed on shutdown
+
+    def get_source(self, name):
+        if name not in self.sources:
+            self.sources[name] = SourceStats()
+        return self.sources[name]
+
+    def on_late(self, item, lag):
+        self.get_source(item[0]).late += 1
+
+    async def handle(self, reader, writer):
+        # a first line {"source": name} names the connection, otherwise it is named by its peer
+        peer = writer.get_extra_info('peername')
+        stats = None
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = jsonio.loads(line)
+                except jsonio.DecodeError:
+                    obj = None
+                if stats is None:
+                    if isinstance(obj, dict) and 'source' in obj and 'type' not in obj and 'query' not in obj:
+                        name = str(obj['source'])
+                    else:
+                        name = str(peer) if peer else 'connection-%d' % (len(self.sources) + 1)
+                    stats = self.get_source(name)
+                    stats.connections += 1
+                stats.lines += 1
+                if not isinstance(obj, dict):
+                    stats.errors += 1
+                elif 'query' in obj:
+                    # labels sent before the query are added before it is answered
+                    stats.queries += 1
+                    await self.queue.join()
+                    try:
+                        response = self.query(obj)
+                    except Exception as e:
+                        # malformed queries are answered like rejected labels, the connection stays open
+                        stats.errors += 1
+                        response = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+                    writer.write(jsonio.dumps(response) + b'\n')
+                    await writer.drain()
+                elif 'type' in obj:
+                    await self.queue.put((name, obj))
+                    stats.labels += 1
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def close_connections(self):
+        # the handlers see end of file and finish, the labels they queued are still flushed
+        handlers = list(self.connections.values())
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    async def consume(self):
+        while True:
+            item = await self.queue.get()
+            self.apply(item)
+            self.queue.task_done()
+            # add whatever else is ready before giving the readers a turn
+            while not self.queue.empty():
+                self.apply(self.queue.get_nowait())
+                self.queue.task_done()
+
+    def apply(self, item):
+        released = self.buffer.push(item) if self.buffer is not None else [item]
+        self.add(released)
+
+    def add(self, items):
+        for name, label in items:
+            try:
+                self.labels.add_label(label)
+            except Exception as e:
+                main.logger.error('Failed to add label from %s: %s (%r)' % (name, label, e))
+                self.get_source(name).errors += 1
+                continue
+            self.get_source(name).added += 1
+
+    def flush(self):
+        # everything left in the queue and the reorder buffer
+        while not self.queue.empty():
+            self.apply(self.queue.get_nowait())
+        if self.buffer is not None:
+            self.add(self.buffer.flush())
+
+    def query(self, request):
+        # answered from the labels added so far, labels held back by the watermark are not seen yet
+        kind = request['query']
+        if kind == 'between':
+            entities = self.labels.entities_between(request['t0'], request['t1'],
+                                                    request.get('include_start', True),
+                                                    request.get('include_end', False))
+            return {'ok': True, 'result': [self.labels.format_entity(entity) for entity in entities]}
+        if kind == 'window':
+            return {'ok': True, 'result': self.labels.query(request['t0'], request['t1'], request.get('classes'),
+                                                            request.get('person'))}
+        if kind == 'neighbors':
+            hops = self.labels.k_hop(get_node(request['node']), request.get('k', 1), request.get('classes'),
+                                     request.get('direction', 'both'), request.get('t0'), request.get('t1'))
+            return {'ok': True, 'result': {main.format_entity_id(node): hop for node, hop in hops.items()}}
+        if kind == 'path':
+            path = self.labels.find_path(get_node(request['source']), get_node(request['target']),
+                                         request.get('classes'), request.get('t0'), request.get('t1'),
+                                         request.get('max_hops'))
+            return {'ok': True, 'result': None if path is None else [self.labels.format_entity(prop) for prop in path]}
+        if kind == 'entity':
+            entity = self.labels.entities.get(parse_entity_id(request.get('id')))
+            if entity is None:
+                return {'ok': False, 'error': 'unknown entity %s' % request.get('id')}
+            return {'ok': True, 'result': self.labels.format_entity(entity)}
+        if kind == 'stats':
+            return {'ok': True, 'result': {
+                'entities': len(self.labels.entities),
+                'queued': self.queue.qsize(),
+                'buffered': len(self.buffer) if self.buffer is not None else 0,
+                'sources': {name: stats.to_dict() for name, stats in self.sources.items()},
+            }}
+        return {'ok': False, 'error': 'unknown query %s' % kind}
+
+    def write(self, path):
+        # .gz and .zst outputs are compressed
+        return kb_writer.write_knowledge_base(self.labels, path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='merge live label streams into one knowledge base')
+    parser.add_argument('--tcp', default=None, help='host:port to listen on')
+    parser.add_argument('--unix', default=None, help='unix socket path to listen on')
+    parser.add_argument('--queue-size', type=int, default=10000, help='labels queued before readers wait')
+    parser.add_argument('--watermark', type=float, default=10.0,
+                        help='seconds a label may arrive out of order, 0 to disable')
+    parser.add_argument('--output', default=None, help='write the knowledge base as JSON lines on shutdown')
+    args = parser.parse_args()
+    if args.tcp is None and args.unix is None:
+        args.tcp = '127.0.0.1:8765'
+    return args
+
+
+async def serve(args):
+    server = IngestServer(main.Labels(), args.queue_size, args.watermark)
+    servers = []
+    if args.tcp is not None:
+        host, port = args.tcp.rsplit(':', 1)
+        servers.append(await asyncio.start_server(server.handle, host, int(port)))
+    if args.unix is not None:
+        servers.append(await asyncio.start_unix_server(server.handle, args.unix))
+    for s in servers:
+        for sock in s.sockets:
+            print('listening on %s' % (sock.getsockname(),), file=sys.stderr)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    consumer = asyncio.ensure_future(server.consume())
+    await stop.wait()
+    # wait_closed() also waits for open connections (python 3.12+), so close them first
+    for s in servers:
+        s.close()
+    await server.close_connections()
+    for s in servers:
+        await s.wait_closed()
+    consumer.cancel()
+    server.flush()
+    if args.output is not None:
+        server.write(args.output)
+    print(json.dumps(server.query({'query': 'stats'})['result']), file=sys.stderr)
+
+
+def main_server():
+    args = parse_args()
+    main.init_logger()
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main_server()
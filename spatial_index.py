@@ -0,0 +1,49 @@
+# uniform grid over the located_at boxes of one second bucket
+# only boxes sharing a grid cell can overlap by a positive area, so merge
+# candidates come from the query box's cells instead of the whole bucket
+
+import collections
+import math
+
+GRID_CELL_SIZE = 128
+
+
+class BoxGrid:
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = collections.defaultdict(list)
+        self.degenerate = []  # boxes without a positive area
+        self.count = 0
+
+    def cell_range(self, coordinates):
+        # [x, y, width, height]
+        x, y, width, height = coordinates
+        cs = self.cell_size
+        return (math.floor(x / cs), math.floor((x + width) / cs),
+                math.floor(y / cs), math.floor((y + height) / cs))
+
+    def add(self, coordinates, item):
+        entry = (self.count, item)
+        self.count += 1
+        if not (coordinates[2] > 0 and coordinates[3] > 0):
+            self.degenerate.append(entry)
+            return
+        x1, x2, y1, y2 = self.cell_range(coordinates)
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                self.cells[(cx, cy)].append(entry)
+
+    def candidates(self, coordinates):
+        # items that may overlap the box, in insertion order
+        if not (coordinates[2] > 0 and coordinates[3] > 0):
+            # a degenerate box has no overlap area, so only another
+            # degenerate box can pass the mergeable test against it
+            return [item for pos, item in self.degenerate]
+        found = dict(self.degenerate)
+        x1, x2, y1, y2 = self.cell_range(coordinates)
+        for cx in range(x1, x2 + 1):
+            for cy in range(y1, y2 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    found.update(cell)
+        return [found[pos] for pos in sorted(found)]
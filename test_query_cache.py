@@ -0,0 +1,36 @@
+# regression tests for the window cache of main.Labels.query
+#   $ python -m pytest test_query_cache.py
+
+import main
+
+BOX = [100, 100, 50, 80]
+
+
+def add_box(labels, seconds, coordinates=BOX, **label):
+    label = dict({'type': 'object', 'class': 'person', 'label': 'person', 'seconds': seconds,
+                  'coordinates': coordinates}, **label)
+    labels.add_label(label)
+
+
+def test_person_query_sees_input_id_merged_into_box():
+    labels = main.Labels()
+    add_box(labels, 5.0)
+    add_box(labels, 5.1)
+    assert labels.query(0, 5.2, person='person_ross') == []
+
+    # overlaps the boxes above, so it is merged into their object, which gains the input id
+    add_box(labels, 5.5, [101, 100, 50, 80], label='Ross', id='person_ross')
+
+    cached = labels.query(0, 5.2, person='person_ross')
+    labels.query_cache.clear()
+    assert len(cached) == 2
+    assert cached == labels.query(0, 5.2, person='person_ross')
+
+
+def test_cached_query_is_kept_without_changes():
+    labels = main.Labels()
+    add_box(labels, 5.0, id='person_ross')
+    first = labels.query(0, 5.2, person='person_ross')
+    add_box(labels, 9.0, [400, 300, 20, 20])
+    assert len(labels.query_cache) == 1
+    assert labels.query(0, 5.2, person='person_ross') == first
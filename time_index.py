@@ -0,0 +1,99 @@
+# sorted time index over label entities
+# lookups are O(log N + k) instead of filtering every entity per query
+
+import bisect
+
+MERGE_SIZE = 1024
+
+
+class TimeIndex:
+    def __init__(self, key='seconds'):
+        self.key = key
+        self.times = []  # sorted time values
+        self.seqs = []   # insertion sequence of each time value
+        self.items = []  # indexed entities in insertion order
+        self.pending_times = []  # run of the entities added since the last merge
+        self.pending_seqs = []
+        self.pending_sorted = True
+
+    @classmethod
+    def build(cls, entities, key='seconds'):
+        times, items = [], []
+        for entity in entities:
+            if 'value' in entity and key in entity['value']:
+                times.append(entity['value'][key])
+                items.append(entity)
+        return cls.from_times(times, items, key)
+
+    @classmethod
+    def from_times(cls, times, items, key='seconds'):
+        # items may be anything, e.g. rows of a compact store
+        index = cls(key)
+        index.items = list(items)
+        index.seqs = sorted(range(len(times)), key=times.__getitem__)
+        index.times = [times[i] for i in index.seqs]
+        return index
+
+    def add(self, entity):
+        if 'value' not in entity or self.key not in entity['value']:
+            return
+        # appended to a run of recent entities, sorted once when it is merged or
+        # searched. inserting into sorted lists would cost O(N) per entity
+        self.pending_times.append(entity['value'][self.key])
+        self.pending_seqs.append(len(self.items))
+        self.pending_sorted = False
+        self.items.append(entity)
+        if len(self.pending_times) > max(MERGE_SIZE, len(self.times) >> 4):
+            self.merge()
+
+    def sort_pending(self):
+        # stable, so equal times keep insertion order. timsort is linear on a run
+        # that is already almost in order, as live labels are
+        if self.pending_sorted:
+            return
+        times, seqs = self.pending_times, self.pending_seqs
+        order = sorted(range(len(times)), key=times.__getitem__)
+        self.pending_times = [times[i] for i in order]
+        self.pending_seqs = [seqs[i] for i in order]
+        self.pending_sorted = True
+
+    def merge(self):
+        # the recent run into the sorted lists. besides sorting the run, this moves
+        # the part of the sorted lists after the earliest recent time, which is short
+        # for live labels (at most the reorder watermark behind) but up to O(N) for
+        # labels added far out of order
+        if not self.pending_times:
+            return
+        self.sort_pending()
+        pos = bisect.bisect_right(self.times, self.pending_times[0])
+        if pos == len(self.times):
+            self.times.extend(self.pending_times)
+            self.seqs.extend(self.pending_seqs)
+        else:
+            # a stable sort of the two sorted runs is a single merge
+            times = self.times[pos:] + self.pending_times
+            seqs = self.seqs[pos:] + self.pending_seqs
+            order = sorted(range(len(times)), key=times.__getitem__)
+            self.times[pos:] = [times[i] for i in order]
+            self.seqs[pos:] = [seqs[i] for i in order]
+        self.pending_times = []
+        self.pending_seqs = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def between(self, t0, t1, include_start=True, include_end=False):
+        # entities with t0 <= t < t1 by default, returned in insertion order
+        self.sort_pending()
+        seqs = []
+        for times, run in ((self.times, self.seqs), (self.pending_times, self.pending_seqs)):
+            if include_start:
+                lo = bisect.bisect_left(times, t0)
+            else:
+                lo = bisect.bisect_right(times, t0)
+            if include_end:
+                hi = bisect.bisect_right(times, t1)
+            else:
+                hi = bisect.bisect_left(times, t1)
+            seqs.extend(run[lo:hi])
+        return [self.items[i] for i in sorted(seqs)]
@@ -0,0 +1,814 @@
+# label graphs of the viewer
+# kept free of kivy so the graphs can also be built and read headlessly
+
+import collections
+import math
+import os
+
+import jsonio
+import label_cache
+import relation_caption
+import vocab
+from entity_store import CompactEntities
+from spatial_index import BoxGrid
+from time_index import TimeIndex
+
+MERGE_TIME_WINDOW = 1.0
+MERGE_OVERLAP_THRESHOLD = 0.5
+# value fields of Labels holding vocabulary ids
+VOCAB_VALUE_KEYS = ('label', 'relation_kb', 'relation_obj')
+# abstract objects whose label is free text, kept as a string
+TEXT_CLASSES = ('subtitle',)
+
+logger = None
+
+
+class LabelsFrame:
+    def __init__(self, merge_time_window=MERGE_TIME_WINDOW, merge_overlap_threshold=MERGE_OVERLAP_THRESHOLD):
+        self.entities = {}
+        self.abstract_object_ids = collections.defaultdict(dict)
+        self.coordinate_object_ids = collections.defaultdict(dict)
+        self.located_at_property_ids = collections.defaultdict(list)
+        self.video_entity_id = None
+        self.ids = {}
+        self.property_id = 0
+        self.object_id = 0
+        self.merge_time_window = merge_time_window
+        self.merge_overlap_threshold = merge_overlap_threshold
+        self.time_index = None
+        self.skipped_labels = 0
+
+    def get_property_id(self):
+        self.property_id += 1
+        return 'P%d' % self.property_id
+
+    def get_object_id(self):
+        self.object_id += 1
+        return 'O%d' % self.object_id
+
+    def get_entities_iter(self):
+        for entity_id, entity in self.entities.items():
+            yield entity
+
+    def compact(self):
+        # read-only columnar copy of the graph built so far
+        return CompactEntities.from_entities(self.get_entities_iter())
+
+    def is_coordinates_mergeable(self, coord_a, coord_b):
+        # [x, y, width, height]
+        a_x, a_y, a_width, a_height = coord_a
+        a_x2 = a_x + a_width
+        a_y2 = a_y + a_height
+        b_x, b_y, b_width, b_height = coord_b
+        b_x2 = b_x + b_width
+        b_y2 = b_y + b_height
+        overlap_width = max(0, min(a_x2, b_x2) - max(a_x, b_x))
+        overlap_height = max(0, min(a_y2, b_y2) - max(a_y, b_y))
+        a_area = a_width * a_height
+        b_area = b_width * b_height
+        overlap_area = overlap_width * overlap_height
+        return (overlap_area > a_area * self.merge_overlap_threshold) and (overlap_area > b_area * self.merge_overlap_threshold)
+
+    def add_entity(self, entity):
+        self.entities[entity['id']] = entity
+        if entity['entity_type'] == 'property' and entity['class'] == 'located_at':
+            seconds = entity['value']['seconds']
+            self.located_at_property_ids[math.floor(seconds)].append(entity['id'])
+        # emotion properties reuse tracker ids, so rebuild rather than append
+        self.time_index = None
+
+    def build_time_index(self):
+        self.time_index = TimeIndex.build(self.get_entities_iter(), 'frames')
+        return self.time_index
+
+    def entities_between(self, f0, f1, include_start=True, include_end=False):
+        if self.time_index is None:
+            self.build_time_index()
+        return self.time_index.between(f0, f1, include_start, include_end)
+
+    def entities_at_frame(self, frame):
+        return self.entities_between(frame, frame + 1)
+
+    def get_video_object(self):
+        if self.video_entity_id is None:
+            entity = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': 'video'
+            }
+            self.video_entity_id = entity['id']
+            self.add_entity(entity)
+            return entity
+        else:
+            return self.entities[self.video_entity_id]
+
+    def get_entity_id_by_coord(self, frames, coordinates):
+        range_start = max(math.floor(frames) - math.ceil(self.merge_time_window), 0)
+        range_end = math.ceil(frames) + math.ceil(self.merge_time_window) + 1
+        for i in range(range_start, range_end):
+            for prop_id in self.located_at_property_ids[i]:
+                prop = self.entities[prop_id]
+                time_mergeable = abs(prop['value']['frames'] - seconds) <= self.merge_time_window
+                prop_coord = self.entities[prop['target']]
+                coord_mergeable = self.is_coordinates_mergeable(coordinates, prop_coord['value']['coordinates'])
+                if time_mergeable and coord_mergeable:
+                    return prop['source']
+        return None
+
+    def get_object_by_coord(self, frames, classes):
+        entity_id = self.get_entity_id_by_coord(frames, classes)
+        if entity_id is not None:
+            return self.entities[entity_id]
+        else:
+            entity = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': 'unknown'
+            }
+            self.add_entity(entity)
+            return entity
+
+    def get_object(self, seconds, obj):
+        if 'id' in obj:
+            #obj_id = self.ids[obj['id']]
+
+            # refine_obj = obj['id'].split('_')[1]
+            if obj['id'] in self.ids :
+                obj_id = self.ids[obj['id']]
+            else:
+                print('error: get_object.')
+                #for key, value in self.entities.items():
+                #    print(key, value)
+                #    obj_id = key
+                #    break
+            return self.entities[obj_id]
+
+        elif 'coordinates' in obj:
+            return self.get_object_by_coord(seconds, obj['coordinates'])
+        else:
+            logger.error('Unknown type of object found in %s' % obj)
+            return None
+
+    def get_coordinate_object(self,types, frames, coordinates, classes,id):
+        coordinates_key = ','.join([str(i) for i in coordinates])
+        if coordinates_key in self.coordinate_object_ids[frames]:
+            return self.coordinate_object_ids[frames][coordinates_key]
+        else:
+            obj = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': types,
+                'value': {
+                    'classes' : classes,
+                    'coordinates': coordinates,
+                    'id' : id,
+                    'frames': frames
+                }
+            }
+            self.coordinate_object_ids[frames][coordinates_key] = obj
+            self.add_entity(obj)
+            return obj
+
+    def get_behave_object(self,types, frames, coordinates, classes):
+        coordinates_key = ','.join([str(i) for i in coordinates])
+        if coordinates_key in self.coordinate_object_ids[frames]:
+            return self.coordinate_object_ids[frames][coordinates_key]
+        else:
+            obj = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': types,
+                'value': {
+                    'classes' : classes,
+                    'coordinates': coordinates,
+                    'frames': frames
+                }
+            }
+            self.coordinate_object_ids[frames][coordinates_key] = obj
+            self.add_entity(obj)
+            return obj
+
+    def get_label_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': object_class,
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+                'label': source['value']['label'] # added by haeyong.k
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_emotion_property(self, frames, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': source['value']['id'],
+            'class': object_class,
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'frames': frames,
+                'label': source['value']['classes'],  # added by haeyong.k
+                'coordinates': source['value']['coordinates']
+            }
+        }
+        #print(source['input_ids'][0])
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_behavior_property(self, frames, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'class': object_class,
+            'id': self.get_property_id(),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'frames': frames,
+                'label': source['value']['classes'],  # added by haeyong.k
+                'coordinates': source['value']['coordinates']
+            }
+        }
+        #print(source['input_ids'][0])
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def add_label(self, label):
+        new_entities = []
+        if label['type'] in ('emotion', 'behavior') and 'frames' not in label:
+            # labels keyed by seconds (e.g. the shipped emotion and action files) have no frame to go to
+            self.skipped_labels += 1
+            return
+        if label['type'] == 'emotion':
+
+            # Overwrite the entity
+            # {"type": "emotion", "class": "neutral", "seconds": 3.167, "object": {"id": "person_phoebe"}}
+            # {"type": "emotion", "class": "surprise", "frames": 34, "coordinates": [393,337,464,409], "id": 1}
+            entity = self.get_coordinate_object('emotion',label['frames'], label['coordinates'],label['class'],label['id'])
+            video_entity = self.get_video_object()
+            entity['value']['id'] = label['id']
+            prop_entity = self.get_emotion_property(label['frames'], 'feel', entity, video_entity)
+
+        elif label['type'] == 'behavior':
+            entity = self.get_behave_object('behavior', label['frames'], label['object']['coordinates'], label['class'])
+            behavior_entity = self.get_video_object()
+            prop_entity = self.get_behavior_property(label['frames'], 'do', entity, behavior_entity)
+
+
+
+class Labels:
+    def __init__(self, merge_time_window=MERGE_TIME_WINDOW, merge_overlap_threshold=MERGE_OVERLAP_THRESHOLD, spatial_index=True):
+        self.entities = {}
+        self.abstract_object_ids = collections.defaultdict(dict)
+        self.coordinate_object_ids = collections.defaultdict(dict)
+        self.located_at_property_ids = collections.defaultdict(list)
+        self.located_at_grids = collections.defaultdict(BoxGrid)
+        self.video_entity_id = None
+        self.ids = {}
+        # class, subclass and label strings are stored as ids of the shared base
+        # vocabulary, extended per graph with the strings it lacks
+        self.vocab = vocab.Vocabulary(base=vocab.get_base_vocabulary())
+        self.property_id = 0
+        self.object_id = 0
+        self.merge_time_window = merge_time_window
+        self.merge_overlap_threshold = merge_overlap_threshold
+        self.time_index = None
+        # the grid only prunes boxes without a positive overlap, which a
+        # negative threshold would still accept
+        self.spatial_index = spatial_index and merge_overlap_threshold >= 0
+
+    def get_property_id(self):
+        self.property_id += 1
+        return 'P%d' % self.property_id
+
+    def get_object_id(self):
+        self.object_id += 1
+        return 'O%d' % self.object_id
+
+    def format_entity(self, entity):
+        # copy of the entity with vocabulary strings, for the compact store
+        strings = self.vocab.strings
+        formatted = dict(entity)
+        if 'class' in formatted:
+            formatted['class'] = strings[formatted['class']]
+        if 'value' in formatted:
+            value = formatted['value'] = dict(formatted['value'])
+            for key in VOCAB_VALUE_KEYS:
+                if type(value.get(key)) is int:
+                    value[key] = strings[value[key]]
+        return formatted
+
+    def get_entities_iter(self):
+        for entity_id, entity in self.entities.items():
+            yield entity
+
+    def compact(self):
+        # read-only columnar copy of the graph built so far
+        return CompactEntities.from_entities(self.format_entity(entity) for entity in self.get_entities_iter())
+
+    def is_coordinates_mergeable(self, coord_a, coord_b):
+        # [x, y, width, height]
+        a_x, a_y, a_width, a_height = coord_a
+        a_x2 = a_x + a_width
+        a_y2 = a_y + a_height
+        b_x, b_y, b_width, b_height = coord_b
+        b_x2 = b_x + b_width
+        b_y2 = b_y + b_height
+        overlap_width = max(0, min(a_x2, b_x2) - max(a_x, b_x))
+        overlap_height = max(0, min(a_y2, b_y2) - max(a_y, b_y))
+        a_area = a_width * a_height
+        b_area = b_width * b_height
+        overlap_area = overlap_width * overlap_height
+        return (overlap_area > a_area * self.merge_overlap_threshold) and (overlap_area > b_area * self.merge_overlap_threshold)
+
+    def add_entity(self, entity):
+        self.entities[entity['id']] = entity
+        if entity['entity_type'] == 'property' and entity['class'] == vocab.LOCATED_AT:
+            seconds = entity['value']['seconds']
+            self.located_at_property_ids[math.floor(seconds)].append(entity['id'])
+            coordinates = self.entities[entity['target']]['value']['coordinates']
+            self.located_at_grids[math.floor(seconds)].add(coordinates, entity['id'])
+        if self.time_index is not None:
+            self.time_index.add(entity)
+
+    def build_time_index(self):
+        self.time_index = TimeIndex.build(self.get_entities_iter(), 'seconds')
+        return self.time_index
+
+    def entities_between(self, t0, t1, include_start=True, include_end=False):
+        if self.time_index is None:
+            self.build_time_index()
+        return self.time_index.between(t0, t1, include_start, include_end)
+
+    def get_video_object(self):
+        if self.video_entity_id is None:
+            entity = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': vocab.VIDEO
+            }
+            self.video_entity_id = entity['id']
+            self.add_entity(entity)
+            return entity
+        else:
+            return self.entities[self.video_entity_id]
+
+    def get_entity_id_by_coord(self, seconds, coordinates):
+        range_start = max(math.floor(seconds) - math.ceil(self.merge_time_window), 0)
+        range_end = math.ceil(seconds) + math.ceil(self.merge_time_window) + 1
+        for i in range(range_start, range_end):
+            if self.spatial_index:
+                grid = self.located_at_grids.get(i)
+                prop_ids = grid.candidates(coordinates) if grid is not None else []
+            else:
+                prop_ids = self.located_at_property_ids[i]
+            for prop_id in prop_ids:
+                prop = self.entities[prop_id]
+                time_mergeable = abs(prop['value']['seconds'] - seconds) <= self.merge_time_window
+                prop_coord = self.entities[prop['target']]
+                coord_mergeable = self.is_coordinates_mergeable(coordinates, prop_coord['value']['coordinates'])
+                if time_mergeable and coord_mergeable:
+                    return prop['source']
+        return None
+
+    def get_object_by_coord(self, seconds, coordinates):
+        entity_id = self.get_entity_id_by_coord(seconds, coordinates)
+        if entity_id is not None:
+            return self.entities[entity_id]
+        else:
+            entity = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': vocab.UNKNOWN
+            }
+            self.add_entity(entity)
+            return entity
+
+    def get_object(self, seconds, obj):
+        if 'id' in obj:
+            #obj_id = self.ids[obj['id']]
+
+            # refine_obj = obj['id'].split('_')[1]
+            if obj['id'] in self.ids :
+                obj_id = self.ids[obj['id']]
+            else:
+                print('error: get_object.')
+                #for key, value in self.entities.items():
+                #    print(key, value)
+                #    obj_id = key
+                #    break
+            return self.entities[obj_id]
+
+        elif 'coordinates' in obj:
+            return self.get_object_by_coord(seconds, obj['coordinates'])
+        else:
+            logger.error('Unknown type of object found in %s' % obj)
+            return None
+
+    def get_coordinate_object(self, seconds, coordinates):
+        coordinates_key = ','.join([str(i) for i in coordinates])
+        if coordinates_key in self.coordinate_object_ids[seconds]:
+            return self.coordinate_object_ids[seconds][coordinates_key]
+        else:
+            obj = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': vocab.VIDEO_BOX,
+                'value': {
+                    'coordinates': coordinates,
+                    'seconds': seconds
+                }
+            }
+            self.coordinate_object_ids[seconds][coordinates_key] = obj
+            self.add_entity(obj)
+            return obj
+
+    def get_abstract_object(self, object_class, label):
+        if label in self.abstract_object_ids[object_class]:
+            return self.abstract_object_ids[object_class][label]
+        else:
+            obj = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': self.vocab.intern(object_class),
+                'value': {
+                    'label': label if object_class in TEXT_CLASSES else self.vocab.intern(label)
+                }
+            }
+            self.add_entity(obj)
+            self.abstract_object_ids[object_class][label] = obj
+            return obj
+
+    def get_event_object(self, object_class, label, sentences):
+
+        if label in self.abstract_object_ids[object_class]:
+            return self.abstract_object_ids[object_class][label]
+        else:
+            obj = {
+                'entity_type': 'object',
+                'id': self.get_object_id(),
+                'class': self.vocab.intern(object_class),
+                'value': {
+                    'verbs': sentences[0]['verbs'],
+                    'sentence': sentences[0]['sentence']
+                }
+            }
+            self.add_entity(obj)
+            self.abstract_object_ids[object_class][label] = obj
+            return obj
+
+    def get_label_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+                'label': source['value']['label'] # added by haeyong.k
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+
+    def get_event_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+                'verbs': source['value']['verbs'] # added by haeyong.k
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_subtitle_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+                'label': source['value']['label'],# added by haeyong.k
+                'id': source['value']['id']
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_behavior_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+                'label': target['value']['label']  # added by haeyong.k
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_emotion_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+                'label': target['value']['label'],  # added by haeyong.k
+                'person': source['input_ids'][0]
+            }
+        }
+        print(source['input_ids'][0])
+        self.add_entity(prop_entity)
+        return prop_entity
+
+
+    def get_relation_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds['seconds'],
+                'source': source['input_ids'], # added by haeyong.k
+                'target': target['input_ids'], # added by haeyong.k
+                'relation_kb': self.vocab.intern(seconds['subclass'])  # added by haeyong.k
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_relation_object_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds['seconds'],
+                'source': source['input_ids'], # added by haeyong.k
+                'source_coordinates' : source['value']['coordinates'], # added by haeyong.k
+                'target': target['input_ids'], # added by haeyong.k
+                'target_coordinates': target['value']['coordinates'], # added by haeyong.k
+                'relation_obj': self.vocab.intern(seconds['subclass']) # added by haeyong.k
+            }
+        }
+        print(prop_entity)
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def get_property(self, seconds, object_class, source, target):
+        prop_entity = {
+            'entity_type': 'property',
+            'id': self.get_property_id(),
+            'class': self.vocab.intern(object_class),
+            'source': source['id'],
+            'target': target['id'],
+            'value': {
+                'seconds': seconds,
+            }
+        }
+        self.add_entity(prop_entity)
+        return prop_entity
+
+    def add_label(self, label):
+        new_entities = []
+        if label['type'] == 'object' :
+            # Overwrite the entity
+            entity = self.get_object_by_coord(label['seconds'], label['coordinates'])
+            entity['entity_type'] = 'object'
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': self.vocab.intern(label['label'])}
+
+            if 'id' in label and label['id'] is not None:
+                if 'input_ids' not in entity:
+                    entity['input_ids'] = []
+                #entity['input_ids'].append(label['id'].split(' ')[0])
+                #self.ids[label['id'].split(' ')[0]] = entity['id']
+                entity['input_ids'].append(label['id'])
+                self.ids[label['id']] = entity['id']
+
+            coord_entity = self.get_coordinate_object(label['seconds'], label['coordinates'])
+            prop_entity = self.get_property(label['seconds'], 'located_at', entity, coord_entity)
+
+        elif label['type'] == 'relation':
+            relation_type_entity = self.get_abstract_object(label['class'], label['subclass'])
+            # Overwrite the entity
+            entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
+            entity['entity_type'] = 'relation'
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': self.vocab.intern(label['class'])}
+
+            if 'id' in label['source'] and label['source']['id'] is not None:
+                if 'input_ids' not in entity:
+                    entity['input_ids'] = []
+                entity['input_ids'].append(label['source']['id'])
+                self.ids[label['source']['id']] = entity['id']
+
+            # Overwrite the entity
+            entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
+            entity['entity_type'] = 'relation'
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': self.vocab.intern(label['class'])}
+
+            if 'id' in label['target'] and label['target']['id'] is not None:
+                if 'input_ids' not in entity:
+                    entity['input_ids'] = []
+                entity['input_ids'].append(label['target']['id'])
+                self.ids[label['target']['id']] = entity['id']
+
+            source_entity = self.get_object(label['seconds'], label['source'])
+            target_entity = self.get_object(label['seconds'], label['target'])
+            #prop_entity = self.get_relation_kbb_property(label['seconds'], 'related_to', source_entity, target_entity)
+            prop_entity = self.get_relation_property(label, 'related_to', source_entity, target_entity)
+            prop_entity['value']['relation'] = relation_type_entity['id']
+
+        elif label['type'] == 'relation_object':
+            relation_type_entity = self.get_abstract_object(label['class'], label['subclass'])
+            # Overwrite the entity
+            entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
+            entity['entity_type'] = 'relation_object'
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': self.vocab.intern(label['class'])}
+
+            if 'id' in label['source'] and label['source']['id'] is not None:
+                if 'input_ids' not in entity:
+                    entity['input_ids'] = []
+                entity['input_ids'].append(label['source']['id'])
+                self.ids[label['source']['id']] = entity['id']
+
+            # Overwrite the entity
+            entity = self.get_object_by_coord(label['seconds'], [0,0,0,0])
+            entity['entity_type'] = 'relation_object'
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': self.vocab.intern(label['class'])}
+
+            if 'id' in label['target'] and label['target']['id'] is not None:
+                if 'input_ids' not in entity:
+                    entity['input_ids'] = []
+                entity['input_ids'].append(label['target']['id'])
+                self.ids[label['target']['id']] = entity['id']
+
+            source_entity = self.get_object(label['seconds'], label['source'])
+            source_entity['value']['coordinates'] = label['source']['coordinates']
+            target_entity = self.get_object(label['seconds'], label['target'])
+            target_entity['value']['coordinates'] = label['target']['coordinates']
+            #prop_entity = self.get_relation_kbb_property(label['seconds'], 'related_to', source_entity, target_entity)
+            prop_entity = self.get_relation_object_property(label, 'related_to_object', source_entity, target_entity)
+            prop_entity['value']['relation'] = relation_type_entity['id']
+
+        elif label['type'] == 'location':
+            entity = self.get_abstract_object('location', label['class'])
+            video_entity = self.get_video_object()
+            prop_entity = self.get_label_property(label['seconds'], 'location_of', entity, video_entity)
+
+        elif label['type'] == 'sound':
+            entity = self.get_abstract_object('sound', label['class'])
+            video_entity = self.get_video_object()
+            prop_entity = self.get_label_property(label['seconds'], 'sound_of', entity, video_entity)
+
+        elif label['type'] == 'emotion':
+
+            # Overwrite the entity
+            # {"type": "emotion", "class": "neutral", "seconds": 3.167, "object": {"id": "person_phoebe"}}
+            # {"type": "emotion", "class": "surprise", "frames": 34, "coordinates": [393,337,464,409], "id": 1}
+            entity = self.get_object_by_coord(label['frames'], label['class'])
+            entity['entity_type'] = 'object'
+            entity['class'] = self.vocab.intern(label['class'])
+            entity['value'] = {'label': self.vocab.intern(label['class'])}
+
+            entity = self.get_object(label['frames'], label['coordinates'])
+            emotion_entity = self.get_abstract_object('emotion', label['class'])
+            prop_entity = self.get_emotion_property(label['frames'], 'feel', entity, emotion_entity)
+
+        elif label['type'] == 'behavior':
+            entity = self.get_object(label['frames'], label['object'])
+            behavior_entity = self.get_abstract_object('behavior', label['class'])
+            prop_entity = self.get_behavior_property(label['frames'], 'do', entity, behavior_entity)
+
+        elif label['type'] == 'subtitle':
+            entity = self.get_abstract_object('subtitle', label['subtitle'])
+            video_entity = self.get_video_object()
+            entity['value']['id'] = label['id']
+            prop_entity = self.get_subtitle_property(label['start_time'], 'subtitle_of', entity, video_entity)
+
+        elif label['type'] == 'event':
+            entity = self.get_event_object('event', label['subtitle'], label['sentences'])
+            video_entity = self.get_video_object()
+            prop_entity = self.get_event_property(label['start_time'], 'event_of', entity, video_entity)
+
+def get_relation_object_label(obj):
+    obj['type'] = 'relation_object'
+    source_id, predicate, target_id = relation_caption.parse_caption(obj['caption'])
+    obj['source']['id'] = source_id
+    obj['target']['id'] = target_id
+    obj['class'] = 'related_to_object'
+    obj['subclass'] = predicate
+    return obj
+
+def build_episode_graphs(sources):
+    # labels keyed by seconds, labels_frames keyed by frame numbers
+    graphs = {'labels': Labels(), 'labels_frames': LabelsFrame()}
+    for path, graph, kind, message in sources:
+        if kind == 'event':
+            objs = jsonio.load_json(path)
+        else:
+            objs = jsonio.iter_jsonl(path)
+        for obj in objs:
+            if kind == 'relation_object':
+                obj = get_relation_object_label(obj)
+            elif kind in ('subtitle', 'event') and 'type' not in obj:
+                obj['type'] = kind
+            graphs[graph].add_label(obj)
+        if message is not None:
+            print(message)
+    if graphs['labels_frames'].skipped_labels:
+        print('skipped %d emotion/behavior labels without frames' % graphs['labels_frames'].skipped_labels)
+
+    # the viewer only reads the graphs, so keep compact copies with time indexes
+    labels = graphs['labels'].compact()
+    labels.build_time_index('seconds')
+    labels_frames = graphs['labels_frames'].compact()
+    labels_frames.build_time_index('frames')
+    return {'labels': labels, 'labels_frames': labels_frames}
+
+def get_episode_sources(season, episode, sound=True, emotion=True, behave=True, place=True,
+                        relation_kbb=True, kb_person=True, subtitle=True, event=True):
+    # (path, graph, kind, message) of every enabled source, in loading order
+    file = 'friends_s{:02d}_e{:02d}.jsonl'.format(season, episode)
+    sources = []
+    if sound :
+        sound = './json/sound_event/data/friends/' + file
+        sources.append((sound, 'labels', 'label', 'sound event detection added successfully.'))
+
+    if emotion:
+        emotion = './json/emotion/data/friends/' + file
+        sources.append((emotion, 'labels_frames', 'label', 'emotion added successfully.'))
+
+    if behave :
+        behavior = './json/action/data/friends/' + file
+        sources.append((behavior, 'labels_frames', 'label', 'behavior added successfully.'))
+
+    if place :
+        place = './json/place/data/friends/' + file
+        sources.append((place, 'labels', 'label', 'places added successfully.'))
+
+    if 0 :
+        relation_object = './json/object/data/friends/' + file
+        sources.append((relation_object, 'labels', 'relation_object', 'relation added successfully.'))
+
+    if relation_kbb:
+        # add knowlege background
+        relation_kbb = './json/triple/data/friends/' + file
+        sources.append((relation_kbb, 'labels', 'label', 'knowlege added successfully.'))
+
+    if kb_person :
+        # add knowlege person
+        relation_kbh = './json/swrc/data/friends/' + file
+        sources.append((relation_kbh, 'labels', 'label', 'knowlege added successfully.'))
+
+    # subtitle
+    if subtitle :
+        subtitle_file = 's{:02d}_e{:02d}.jsonl'.format(season, episode)
+        subtitle = './subtitle/' + subtitle_file
+        sources.append((subtitle, 'labels', 'subtitle', None))
+
+    if event :
+        event_file = 'friends_s{:02d}_e{:02d}.json'.format(season, episode)
+        event = './json/event/data/friends/' + event_file
+        sources.append((event, 'labels', 'event', None))
+    return sources
+
+def load_episode_graphs(season, episode, sources):
+    # the built graphs and their time indexes are cached on disk and only
+    # rebuilt when one of the sources changes. the returned graphs are read-only
+    # and their columns memory-mapped from the cache directory
+    cache_dir = './cache/friends_s{:02d}_e{:02d}.graph'.format(season, episode)
+    # the relation vocabulary decides how relation_object captions are parsed
+    paths = [source[0] for source in sources]
+    if any(source[2] == 'relation_object' for source in sources) and os.path.exists(relation_caption.VOCAB_PATH):
+        paths.append(relation_caption.VOCAB_PATH)
+    return label_cache.load_or_build(cache_dir, paths,
+                                     lambda: build_episode_graphs(sources),
+                                     extra=[source[1:3] for source in sources])
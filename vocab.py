@@ -0,0 +1,75 @@
+# interned vocabulary of label strings
+# classes, subclasses and labels are kept in the graph as small integer ids. the ids
+# come from one read-only base table per process: the classes the builder creates
+# itself (fixed ids), then the object and relation vocabularies of json/object.
+# every graph gets its own table on top of the base for strings the base lacks, so
+# those are freed with their graph; free text like subtitles is not interned
+
+import os
+
+VOCAB_PATHS = ['./json/object/vocab.txt', './json/object/vocab_pred_relation.txt']
+
+CORE_WORDS = [
+    'unknown', 'video', 'video_box', 'located_at',
+    'location', 'location_of', 'sound', 'sound_of', 'subtitle', 'subtitle_of',
+    'behavior', 'do', 'emotion', 'feel', 'related_to', 'related_to_object',
+]
+CORE_IDS = {word: i for i, word in enumerate(CORE_WORDS)}
+UNKNOWN, VIDEO, VIDEO_BOX, LOCATED_AT = range(4)
+
+
+class Vocabulary:
+    def __init__(self, words=(), base=None):
+        # with a base, its ids are kept and new strings get ids after them. strings
+        # holds references to the base strings, ids only the strings added here
+        self.base = base
+        self.strings = list(base.strings) if base is not None else []  # id -> string
+        self.ids = {}  # string -> id
+        if base is None:
+            for word in CORE_WORDS:
+                self.intern(word)
+        for word in words:
+            self.intern(word)
+
+    @classmethod
+    def from_files(cls, paths=VOCAB_PATHS):
+        words = []
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                words.extend(word for word in (line.strip() for line in f) if word)
+        return cls(words)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def intern(self, string):
+        string_id = self.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def get(self, string, default=None):
+        # id of a known string, without adding it
+        if self.base is not None:
+            string_id = self.base.ids.get(string)
+            if string_id is not None:
+                return string_id
+        return self.ids.get(string, default)
+
+
+base_vocabulary = None
+
+
+def get_base_vocabulary():
+    # shared by every graph of the process and never added to after loading, the
+    # vocabulary files are read on first use
+    global base_vocabulary
+    if base_vocabulary is None:
+        base_vocabulary = Vocabulary.from_files()
+    return base_vocabulary